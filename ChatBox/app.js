@@ -81,6 +81,7 @@
   const GIFT_RECIPIENT_DEBUG_API_PATH = "/api/debug/gift-recipient";
   const PARSE_FAILURE_DEBUG_API_PATH = "/api/debug/parse-failures";
   const HISTORY_SYNC_INTERVAL_MS = 2500;
+  const HISTORY_SYNC_PAGE_LIMIT = 500;
   const HISTORY_STREAM_BACKUP_POLL_MS = 15000;
   const SUPPORT_TRAIN_WINDOW_MS = 90000;
   const SUPPORT_TRAIN_TRIGGER_POINTS = 22;
@@ -149,10 +150,15 @@
     suppressScrollPauseUntil: 0,
     initialAutoFollowUntil: 0,
     historySyncInFlight: false,
+    historyLoadInFlight: false,
+    historyLoadGeneration: 0,
     historyEventSource: null,
     historyStreamConnected: false,
     lastHistoryRealtimeAt: 0,
     lastHistoryPollAt: 0,
+    historyCursor: null,
+    historyLastEventId: "",
+    historyRemovedCursor: null,
     removedMessageIds: new Set(),
     twitchAvatarCache: new Map(),
     twitchAvatarPending: new Set(),
@@ -551,7 +557,7 @@
     }
 
     try {
-      const response = await fetch(RUNTIME_STATE_API_PATH, { cache: "no-store" });
+      const response = await fetch(RUNTIME_STATE_API_PATH, { cache: "no-cache" });
       if (!response.ok) {
         return null;
       }
@@ -640,44 +646,47 @@
     }
 
     try {
-      const response = await fetch(SETTINGS_API_PATH, { cache: "no-store" });
+      const response = await fetch(SETTINGS_API_PATH, { cache: "no-cache" });
       if (!response.ok) {
         return null;
       }
-      const payload = await response.json();
-      if (!payload || typeof payload !== "object") {
-        return null;
-      }
-
-      return {
-        streamLiteEffects: payload.streamLiteEffects !== undefined ? !!payload.streamLiteEffects : !!payload.liteEffects,
-        dockLiteEffects: payload.dockLiteEffects !== undefined ? !!payload.dockLiteEffects : !!payload.liteEffects,
-        streamShowFollowAlerts: payload.streamShowFollowAlerts !== undefined ? payload.streamShowFollowAlerts !== false : payload.showFollowAlerts !== false,
-        dockShowFollowAlerts: payload.dockShowFollowAlerts !== undefined ? payload.dockShowFollowAlerts !== false : payload.showFollowAlerts !== false,
-        streamIgnoreBangCommands: payload.streamIgnoreBangCommands !== undefined ? !!payload.streamIgnoreBangCommands : !!payload.ignoreBangCommands,
-        dockIgnoreBangCommands: payload.dockIgnoreBangCommands !== undefined ? !!payload.dockIgnoreBangCommands : !!payload.ignoreBangCommands,
-        streamHideDeletedMessages: payload.streamHideDeletedMessages !== undefined ? !!payload.streamHideDeletedMessages : !!payload.hideDeletedMessages,
-        dockHideDeletedMessages: payload.dockHideDeletedMessages !== undefined ? !!payload.dockHideDeletedMessages : false,
-        streamShowStatus: payload.streamShowStatus !== undefined ? payload.streamShowStatus !== false : false,
-        dockShowStatus: payload.dockShowStatus !== undefined ? payload.dockShowStatus !== false : (payload.showStatus !== false),
-        ignoreUsersStream: Array.isArray(payload.ignoreUsersStream)
-          ? payload.ignoreUsersStream.map((value) => normalizeUserName(value)).filter(Boolean)
-          : [],
-        ignoreUsersDock: Array.isArray(payload.ignoreUsersDock)
-          ? payload.ignoreUsersDock.map((value) => normalizeUserName(value)).filter(Boolean)
-          : [],
-        trainPosition: ["top-left", "bottom-left", "bottom-center"].includes(String(payload.trainPosition || "").trim().toLowerCase())
-          ? String(payload.trainPosition).trim().toLowerCase()
-          : "bottom-left",
-        trainWidth: parseStoredTrainWidth(payload.trainWidth, parseOptionalPixelValue(config.trainWidth)),
-        trainScale: parseStoredTrainScale(payload.trainScale, Number.isFinite(config.trainScale) ? config.trainScale : 1),
-        trainCompact: !!payload.trainCompact,
-      };
+      return normalizeSharedOverlaySettings(await response.json());
     } catch (error) {
       return null;
     }
   }
 
+  function normalizeSharedOverlaySettings(payload) {
+    if (!payload || typeof payload !== "object") {
+      return null;
+    }
+
+    return {
+      streamLiteEffects: payload.streamLiteEffects !== undefined ? !!payload.streamLiteEffects : !!payload.liteEffects,
+      dockLiteEffects: payload.dockLiteEffects !== undefined ? !!payload.dockLiteEffects : !!payload.liteEffects,
+      streamShowFollowAlerts: payload.streamShowFollowAlerts !== undefined ? payload.streamShowFollowAlerts !== false : payload.showFollowAlerts !== false,
+      dockShowFollowAlerts: payload.dockShowFollowAlerts !== undefined ? payload.dockShowFollowAlerts !== false : payload.showFollowAlerts !== false,
+      streamIgnoreBangCommands: payload.streamIgnoreBangCommands !== undefined ? !!payload.streamIgnoreBangCommands : !!payload.ignoreBangCommands,
+      dockIgnoreBangCommands: payload.dockIgnoreBangCommands !== undefined ? !!payload.dockIgnoreBangCommands : !!payload.ignoreBangCommands,
+      streamHideDeletedMessages: payload.streamHideDeletedMessages !== undefined ? !!payload.streamHideDeletedMessages : !!payload.hideDeletedMessages,
+      dockHideDeletedMessages: payload.dockHideDeletedMessages !== undefined ? !!payload.dockHideDeletedMessages : false,
+      streamShowStatus: payload.streamShowStatus !== undefined ? payload.streamShowStatus !== false : false,
+      dockShowStatus: payload.dockShowStatus !== undefined ? payload.dockShowStatus !== false : (payload.showStatus !== false),
+      ignoreUsersStream: Array.isArray(payload.ignoreUsersStream)
+        ? payload.ignoreUsersStream.map((value) => normalizeUserName(value)).filter(Boolean)
+        : [],
+      ignoreUsersDock: Array.isArray(payload.ignoreUsersDock)
+        ? payload.ignoreUsersDock.map((value) => normalizeUserName(value)).filter(Boolean)
+        : [],
+      trainPosition: ["top-left", "bottom-left", "bottom-center"].includes(String(payload.trainPosition || "").trim().toLowerCase())
+        ? String(payload.trainPosition).trim().toLowerCase()
+        : "bottom-left",
+      trainWidth: parseStoredTrainWidth(payload.trainWidth, parseOptionalPixelValue(config.trainWidth)),
+      trainScale: parseStoredTrainScale(payload.trainScale, Number.isFinite(config.trainScale) ? config.trainScale : 1),
+      trainCompact: !!payload.trainCompact,
+    };
+  }
+
   function getOverlaySettingsSignature(settings) {
     if (!settings || typeof settings !== "object") {
       return "";
@@ -3444,7 +3453,7 @@
 
     state.youtubeStickerMapLastAttemptAt = now;
     state.youtubeStickerMapPromise = fetch(YOUTUBE_SUPER_STICKER_MAP_PATH, {
-      cache: "no-store",
+      cache: "no-cache",
     })
       .then((response) => {
         if (!response.ok) {
@@ -5756,7 +5765,11 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
   }
 
   function loadPersistedFeed() {
+    state.historyLoadGeneration += 1;
+    const generation = state.historyLoadGeneration;
     state.feedItems = [];
+    state.historyCursor = null;
+    state.historyRemovedCursor = null;
 
     if (isLocalOnlyMode()) {
       loadLocalBackup();
@@ -5767,7 +5780,9 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
       return;
     }
 
-    fetch(HISTORY_API_PATH, { cache: "no-store" })
+    const tail = config.maxMessages > 0 ? config.maxMessages : 0;
+    state.historyLoadInFlight = true;
+    fetch(`${HISTORY_API_PATH}?tail=${tail}`, { cache: "no-cache" })
       .then((response) => {
         if (!response.ok) {
           throw new Error(`History request failed with ${response.status}`);
@@ -5775,8 +5790,13 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
         return response.json();
       })
       .then((payload) => {
-        if (Array.isArray(payload)) {
-          state.feedItems = payload.filter(isValidStoredMessage).filter((item) => passesFeedClearCutoff(item));
+        if (generation !== state.historyLoadGeneration) {
+          return;
+        }
+        const messages = Array.isArray(payload) ? payload : (payload && Array.isArray(payload.messages) ? payload.messages : null);
+        if (messages) {
+          applyHistoryCursor(payload);
+          state.feedItems = messages.filter(isValidStoredMessage).filter((item) => passesFeedClearCutoff(item));
           hydratePlatformStatusFromHistory();
           syncLocalBackup();
           renderFeed();
@@ -5784,32 +5804,67 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
         }
       })
       .catch(() => {
+        if (generation !== state.historyLoadGeneration) {
+          return;
+        }
         loadLocalBackup();
         state.feedItems = state.feedItems.filter((item) => passesFeedClearCutoff(item));
         hydratePlatformStatusFromHistory();
         renderFeed();
         scheduleScrollToLatestBurst();
+      })
+      .finally(() => {
+        if (generation === state.historyLoadGeneration) {
+          state.historyLoadInFlight = false;
+        }
       });
   }
 
-  function pollPersistedFeed() {
+  function applyHistoryCursor(payload) {
+    if (!payload || Array.isArray(payload) || typeof payload !== "object") {
+      return;
+    }
+    if (typeof payload.cursor === "number") {
+      state.historyCursor = payload.cursor;
+    }
+    if (typeof payload.removedCursor === "number") {
+      state.historyRemovedCursor = payload.removedCursor;
+    }
+  }
+
+  function pollPersistedFeed(options = {}) {
     if (isLocalOnlyMode()) {
       return;
     }
 
     const now = Date.now();
-    if (state.historyStreamConnected && now - state.lastHistoryRealtimeAt < HISTORY_STREAM_BACKUP_POLL_MS) {
+    if (!options.force && state.historyStreamConnected && now - state.lastHistoryRealtimeAt < HISTORY_STREAM_BACKUP_POLL_MS) {
       return;
     }
 
-    if (state.historySyncInFlight) {
+    if (state.historySyncInFlight || state.historyLoadInFlight) {
+      return;
+    }
+
+    if (state.historyCursor === null) {
+      loadPersistedFeed();
       return;
     }
 
     state.historySyncInFlight = true;
     state.lastHistoryPollAt = now;
+    const generation = state.historyLoadGeneration;
+
+    const params = new URLSearchParams({
+      since: String(state.historyCursor),
+      limit: String(HISTORY_SYNC_PAGE_LIMIT),
+    });
+    if (state.historyRemovedCursor !== null) {
+      params.set("removedSince", String(state.historyRemovedCursor));
+    }
 
-    fetch(HISTORY_API_PATH, { cache: "no-store" })
+    let hasMore = false;
+    fetch(`${HISTORY_API_PATH}?${params.toString()}`, { cache: "no-cache" })
       .then((response) => {
         if (!response.ok) {
           throw new Error(`History request failed with ${response.status}`);
@@ -5817,33 +5872,58 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
         return response.json();
       })
       .then((payload) => {
-        if (!Array.isArray(payload)) {
+        if (generation !== state.historyLoadGeneration || !payload || !Array.isArray(payload.messages)) {
+          return;
+        }
+
+        if (payload.reset) {
+          loadPersistedFeed();
           return;
         }
 
-        const nextItems = payload.filter(isValidStoredMessage).filter((item) => passesFeedClearCutoff(item));
-        if (getFeedSignature(nextItems) === getFeedSignature(state.feedItems)) {
+        applyHistoryCursor(payload);
+        hasMore = !!payload.hasMore;
+
+        for (const removal of Array.isArray(payload.removals) ? payload.removals : []) {
+          if (removal && typeof removal.messageId === "string" && removal.messageId) {
+            markMessageRemoved(removal.messageId, { skipHistorySync: true, platform: removal.platform || "" });
+          }
+        }
+
+        const knownSignatures = new Set(state.feedItems.map((item) => getMessageSignature(item)));
+        const appendedItems = [];
+        for (const item of payload.messages) {
+          if (!isValidStoredMessage(item) || !passesFeedClearCutoff(item)) {
+            continue;
+          }
+          const signature = getMessageSignature(item);
+          if (knownSignatures.has(signature)) {
+            continue;
+          }
+          knownSignatures.add(signature);
+          appendedItems.push(item);
+        }
+        if (!appendedItems.length) {
           return;
         }
 
-        const previousCount = state.feedItems.length;
+        state.feedItems.push(...appendedItems);
+        const shouldTrim = config.maxMessages > 0 && state.feedItems.length > config.maxMessages;
+        if (shouldTrim) {
+          state.feedItems.splice(0, state.feedItems.length - config.maxMessages);
+        }
+
         let visibleAddedCount = 0;
-        if (canAppendIncrementally(state.feedItems, nextItems)) {
-          const appendedItems = nextItems.slice(previousCount);
-          state.feedItems = nextItems;
-          for (const item of appendedItems) {
-            if (shouldDisplayMessage(item)) {
-              visibleAddedCount += 1;
-            }
+        for (const item of appendedItems) {
+          if (shouldDisplayMessage(item)) {
+            visibleAddedCount += 1;
+          }
+          if (!shouldTrim) {
             appendMessageToFeed(item);
           }
-        } else {
-          state.feedItems = nextItems;
+        }
+        if (shouldTrim) {
           renderFeed();
-          visibleAddedCount = nextItems
-            .slice(previousCount)
-            .filter((item) => shouldDisplayMessage(item))
-            .length;
         }
         hydratePlatformStatusFromHistory();
         syncLocalBackup();
@@ -5865,6 +5945,9 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
       })
       .finally(() => {
         state.historySyncInFlight = false;
+        if (hasMore) {
+          pollPersistedFeed(options);
+        }
       });
   }
 
@@ -5881,13 +5964,17 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
       state.historyEventSource.close();
     }
 
-    const source = new EventSource(HISTORY_STREAM_PATH);
+    const streamUrl = state.historyLastEventId
+      ? `${HISTORY_STREAM_PATH}?lastEventId=${encodeURIComponent(state.historyLastEventId)}`
+      : HISTORY_STREAM_PATH;
+    const source = new EventSource(streamUrl);
     state.historyEventSource = source;
     state.historyStreamConnected = false;
 
     source.onopen = () => {
       if (state.historyEventSource === source) {
         state.historyStreamConnected = true;
+        void syncOverlaySettingsFromStorage({ force: true });
       }
     };
 
@@ -5896,6 +5983,10 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
         return;
       }
 
+      if (event.lastEventId) {
+        state.historyLastEventId = event.lastEventId;
+      }
+
       let payload;
       try {
         payload = JSON.parse(event.data);
@@ -5903,12 +5994,32 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
         return;
       }
 
+      if (payload && payload.type === "resync") {
+        state.lastHistoryRealtimeAt = Date.now();
+        pollPersistedFeed({ force: true });
+        void syncOverlaySettingsFromStorage({ force: true });
+        return;
+      }
+
+      if (payload && payload.type === "settings") {
+        applySharedOverlaySettings(normalizeSharedOverlaySettings(payload.settings));
+        return;
+      }
+
       if (payload && payload.type === "message" && isValidStoredMessage(payload.message)) {
         state.lastHistoryRealtimeAt = Date.now();
         appendHistoryMessage(payload.message);
         return;
       }
 
+      if (payload && payload.type === "batch" && Array.isArray(payload.messages)) {
+        state.lastHistoryRealtimeAt = Date.now();
+        for (const message of payload.messages) {
+          appendHistoryMessage(message);
+        }
+        return;
+      }
+
       if (payload && payload.type === "remove" && typeof payload.messageId === "string") {
         state.lastHistoryRealtimeAt = Date.now();
         markMessageRemoved(payload.messageId, { skipHistorySync: true, platform: payload.platform || "" });
@@ -6016,9 +6127,16 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
     }
   }
 
-  async function syncOverlaySettingsFromStorage() {
-    const nextSettings = (await fetchSharedOverlaySettings()) || loadOverlaySettings();
-    if (getOverlaySettingsSignature(nextSettings) === getOverlaySettingsSignature(state.overlaySettings)) {
+  async function syncOverlaySettingsFromStorage(options = {}) {
+    if (!options.force && state.historyStreamConnected) {
+      return;
+    }
+
+    applySharedOverlaySettings((await fetchSharedOverlaySettings()) || loadOverlaySettings());
+  }
+
+  function applySharedOverlaySettings(nextSettings) {
+    if (!nextSettings || getOverlaySettingsSignature(nextSettings) === getOverlaySettingsSignature(state.overlaySettings)) {
       return;
     }
 
@@ -6086,44 +6204,6 @@ ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord} ${loopWord}`;
       );
   }
 
-  function getFeedSignature(items) {
-    if (!Array.isArray(items) || !items.length) {
-      return "";
-    }
-
-    return items.map((item) => [
-      item.platform,
-      item.variant,
-      item.username,
-      item.text,
-      JSON.stringify(item.contentParts || []),
-      item.timestamp,
-      item.amountText || "",
-      item.tone || "",
-      item.giftId || "",
-      item.giftName || "",
-      item.giftImageUrl || "",
-    ].join("\u001f")).join("\u001e");
-  }
-
-  function canAppendIncrementally(currentItems, nextItems) {
-    if (!Array.isArray(currentItems) || !Array.isArray(nextItems)) {
-      return false;
-    }
-
-    if (nextItems.length <= currentItems.length) {
-      return false;
-    }
-
-    for (let index = 0; index < currentItems.length; index += 1) {
-      if (getMessageSignature(currentItems[index]) !== getMessageSignature(nextItems[index])) {
-        return false;
-      }
-    }
-
-    return true;
-  }
-
   function getMessageSignature(item) {
     if (!item) {
       return "";
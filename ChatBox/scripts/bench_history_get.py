@@ -0,0 +1,110 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import history_server  # noqa: E402
+
+
+def build_message(index: int, now_ms: int) -> dict:
+    platform = ("twitch", "kick", "youtube")[index % 3]
+    return {
+        "platform": platform,
+        "variant": "special" if index % 25 == 0 else "chat",
+        "username": f"Chatter{index % 400}",
+        "userId": f"{platform}-{index % 400}",
+        "text": f"message {index} with a few words of chat text Kappa",
+        "color": "#9147ff",
+        "avatarUrl": f"https://static-cdn.example/avatars/{index % 400}.png",
+        "timestamp": now_ms - (200_000 - index) * 1000,
+        "badges": ["Moderator", "Subscriber"] if index % 5 == 0 else ["Subscriber"],
+        "amountText": "$5.00" if index % 25 == 0 else "",
+        "messageId": f"bench-{index}",
+        "contentParts": [
+            {"type": "text", "text": f"message {index} with a few words of chat text "},
+            {"type": "emote", "imageUrl": f"https://static-cdn.example/emotes/{index % 60}.png", "text": "Kappa"},
+        ],
+    }
+
+
+def fill_database(rows: int) -> None:
+    now_ms = int(time.time() * 1000)
+    with history_server.DB_LOCK, history_server.db_connection() as connection:
+        for index in range(rows):
+            history_server.insert_history_message(connection, build_message(index, now_ms))
+        connection.commit()
+
+
+def load_rows() -> list:
+    with history_server.db_connection() as connection:
+        return connection.execute(
+            f"SELECT {history_server.HISTORY_SELECT_COLUMNS} FROM {history_server.HISTORY_SELECT_FROM} "
+            "ORDER BY m.timestamp_ms ASC, m.id ASC"
+        ).fetchall()
+
+
+def encode_dicts() -> int:
+    payload = [history_server.row_to_message(row) for row in load_rows()]
+    return len(json.dumps(payload, ensure_ascii=True).encode("utf-8"))
+
+
+def encode_fragments() -> int:
+    fragments = [b"[", *history_server.join_json_fragments(history_server.encode_message_rows(load_rows())), b"]"]
+    return sum(len(chunk) for chunk in history_server.chunk_fragments(fragments))
+
+
+def measure(name: str, run, repeat: int, rows: int, before=None) -> None:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        size = run()
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"  {name:<28} {best * 1000:9.1f} ms  {rows / best:11,.0f} rows/s  {size / 1024 / 1024:7.1f} MiB")
+
+
+def clear_message_cache() -> None:
+    with history_server.MESSAGE_JSON_LOCK:
+        history_server.MESSAGE_JSON_CACHE.clear()
+
+
+def main():
+    flags = {arg for arg in sys.argv[1:] if arg.startswith("--")}
+    counts = [int(arg) for arg in sys.argv[1:] if not arg.startswith("--")] or [10_000, 60_000, 100_000]
+    repeat = 3 if "--quick" not in flags else 1
+    fast_encoder = history_server.orjson
+    history_server.configure_message_json_cache()
+    cache_entries = history_server.MESSAGE_JSON_CACHE_MAX_ENTRIES
+    print(f"orjson: {'yes' if fast_encoder is not None else 'no'}, repeat: {repeat}, message cache: {cache_entries:,} entries")
+
+    for rows in counts:
+        with tempfile.TemporaryDirectory() as directory:
+            history_server.close_db_pool()
+            history_server.DB_PATH = Path(directory) / "overlay_history.db"
+            history_server.forget_interned_values()
+            clear_message_cache()
+            history_server.init_db()
+            started = time.perf_counter()
+            fill_database(rows)
+            print(f"{rows:,} rows (filled in {time.perf_counter() - started:.1f}s)")
+
+            measure("dicts + json.dumps", encode_dicts, repeat, rows)
+            history_server.orjson = None
+            measure("fragments, json, cold", encode_fragments, repeat, rows, before=clear_message_cache)
+            history_server.orjson = fast_encoder
+            if fast_encoder is not None:
+                measure("fragments, orjson, cold", encode_fragments, repeat, rows, before=clear_message_cache)
+            encode_fragments()
+            warm_label = "fragments, warm cache" if rows <= cache_entries else "fragments, over cache cap"
+            measure(warm_label, encode_fragments, repeat, rows)
+            history_server.close_db_pool()
+
+
+if __name__ == "__main__":
+    main()
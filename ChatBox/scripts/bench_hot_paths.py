@@ -0,0 +1,329 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Event, Thread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import history_server  # noqa: E402
+from load_test import build_message  # noqa: E402
+
+
+DEFAULT_BASELINE_PATH = history_server.ROOT / "data" / "bench-baseline.json"
+DEFAULT_THRESHOLD_PERCENT = 10.0
+DEFAULT_DUPLICATE_ROWS = [1_000, 100_000, 1_000_000]
+DEFAULT_SUBSCRIBERS = [0, 10, 50]
+DEFAULT_DEBUG_LINES = [10_000, 200_000]
+SAMPLE_MESSAGES = 1000
+FILL_BATCH_ROWS = 50_000
+BROADCASTS_PER_RUN = 1000
+DEBUG_LOADS_PER_RUN = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for history_server.py hot paths.")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (default 5)")
+    parser.add_argument("--quick", action="store_true", help="1 repeat and skip the 1M row and largest cases")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    parser.add_argument(
+        "--save",
+        nargs="?",
+        const=str(DEFAULT_BASELINE_PATH),
+        help=f"write results as a baseline (default {DEFAULT_BASELINE_PATH})",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="?",
+        const=str(DEFAULT_BASELINE_PATH),
+        help=f"compare against a saved baseline (default {DEFAULT_BASELINE_PATH})",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD_PERCENT,
+        help=f"percent slowdown that counts as a regression (default {DEFAULT_THRESHOLD_PERCENT:g})",
+    )
+    return parser.parse_args()
+
+
+def measure(run, ops: int, repeat: int) -> dict:
+    run()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return {
+        "ops": ops,
+        "repeat": repeat,
+        "bestNsPerOp": round(min(timings) / ops * 1e9, 1),
+        "medianNsPerOp": round(statistics.median(timings) / ops * 1e9, 1),
+    }
+
+
+def sample_messages(count: int, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    return [build_message(rng, 0, index, now_ms - (count - index) * 500) for index in range(count)]
+
+
+def fill_messages(connection, start: int, stop: int, now_ms: int) -> None:
+    for offset in range(start, stop, FILL_BATCH_ROWS):
+        rows = []
+        for index in range(offset, min(stop, offset + FILL_BATCH_ROWS)):
+            payload = {
+                "platform": ("twitch", "kick", "youtube")[index % 3],
+                "variant": "chat",
+                "username": f"Filler{index % 5000}",
+                "text": f"filler message {index}",
+                "timestamp": now_ms - (stop - index) * 50,
+            }
+            rows.append(
+                (
+                    payload["platform"],
+                    payload["variant"],
+                    payload["username"],
+                    payload["text"],
+                    payload["timestamp"],
+                    "[]",
+                    f"filler-{index}",
+                    history_server.payload_dedupe_keys(payload)[0],
+                )
+            )
+        connection.executemany(
+            """
+            INSERT INTO messages (
+                platform, variant, username, text, timestamp_ms, badges_json, message_id, dedupe_key
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+    connection.commit()
+
+
+def bench_message_paths(args, results: dict, directory: Path) -> None:
+    history_server.close_db_pool()
+    history_server.DB_PATH = directory / "overlay_history.db"
+    history_server.forget_interned_values()
+    history_server.init_db()
+    messages = sample_messages(SAMPLE_MESSAGES)
+
+    def run_is_valid_message():
+        for message in messages:
+            history_server.is_valid_message(message)
+
+    run_benchmark(args, results, "is_valid_message", run_is_valid_message, len(messages))
+
+    with history_server.DB_LOCK, history_server.db_connection() as connection:
+        for message in messages:
+            history_server.insert_history_message(connection, message)
+        connection.commit()
+        rows = connection.execute(
+            f"SELECT {history_server.HISTORY_SELECT_COLUMNS} FROM {history_server.HISTORY_SELECT_FROM} "
+            "ORDER BY m.id ASC"
+        ).fetchall()
+
+    def run_row_to_message():
+        for row in rows:
+            history_server.row_to_message(row)
+
+    run_benchmark(args, results, "row_to_message", run_row_to_message, len(rows))
+
+    probes = messages[::2] + sample_messages(SAMPLE_MESSAGES // 2, seed=11)
+    sizes = [size for size in DEFAULT_DUPLICATE_ROWS if not (args.quick and size > 100_000)]
+    now_ms = int(time.time() * 1000)
+    filled = len(messages)
+    with history_server.db_connection() as connection:
+        for size in sizes:
+            name = f"is_duplicate_message[{size}]"
+            if args.filter and args.filter not in name:
+                continue
+            if size > filled:
+                started = time.perf_counter()
+                fill_messages(connection, filled, size, now_ms)
+                filled = size
+                print(f"  (filled {size:,} rows in {time.perf_counter() - started:.1f}s)")
+
+            def run_is_duplicate_message():
+                for probe in probes:
+                    history_server.is_duplicate_message(connection, probe)
+
+            run_benchmark(args, results, name, run_is_duplicate_message, len(probes))
+    history_server.close_db_pool()
+
+
+def bench_sanitizers(args, results: dict) -> None:
+    settings = [
+        {
+            "streamLiteEffects": index % 2 == 0,
+            "dockShowFollowAlerts": True,
+            "streamIgnoreBangCommands": True,
+            "ignoreUsersStream": ["@Nightbot", "StreamElements", f"spammer{index}"],
+            "ignoreUsersDock": ["Moobot", f"bot{index}"],
+            "trainPosition": "Bottom-Center",
+            "trainWidth": str(700 + index % 300),
+            "trainScale": 1.25,
+            "trainCompact": index % 3 == 0,
+        }
+        for index in range(SAMPLE_MESSAGES)
+    ]
+    runtime = [
+        {
+            platform_key: {
+                "connected": True,
+                "accountConnected": index % 2 == 0,
+                "chatConfirmed": True,
+                "label": f" Live · {index} ",
+                "tone": "connected",
+                "lastMessageAt": 1_700_000_000_000 + index,
+                "viewerCount": str(index * 3),
+            }
+            for platform_key in ("Twitch", "kick", "youtube")
+        }
+        for index in range(SAMPLE_MESSAGES)
+    ]
+
+    def run_sanitize_overlay_settings():
+        for payload in settings:
+            history_server.sanitize_overlay_settings(payload)
+
+    def run_sanitize_runtime_state():
+        for payload in runtime:
+            history_server.sanitize_runtime_state(payload)
+
+    run_benchmark(args, results, "sanitize_overlay_settings", run_sanitize_overlay_settings, len(settings))
+    run_benchmark(args, results, "sanitize_runtime_state", run_sanitize_runtime_state, len(runtime))
+
+
+def run_stream_subscriber(token: object, stop: Event) -> None:
+    cursor, _ = history_server.open_stream_cursor(token)
+    try:
+        while not stop.is_set():
+            _, cursor, _ = history_server.read_stream_events(token, cursor, 0.2)
+    finally:
+        history_server.close_stream_cursor(token)
+
+
+def bench_broadcast(args, results: dict) -> None:
+    payloads = [{"type": "message", "message": message} for message in sample_messages(BROADCASTS_PER_RUN, seed=3)]
+    counts = [count for count in DEFAULT_SUBSCRIBERS if not (args.quick and count > 10)]
+    for count in counts:
+        name = f"broadcast_history_event[{count} subscribers]"
+        if args.filter and args.filter not in name:
+            continue
+        stop = Event()
+        threads = [Thread(target=run_stream_subscriber, args=(object(), stop), daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        while len(history_server.STREAM_SUBSCRIBERS) < count:
+            time.sleep(0.01)
+
+        def run_broadcast_history_event():
+            for payload in payloads:
+                history_server.broadcast_history_event(payload)
+
+        try:
+            run_benchmark(args, results, name, run_broadcast_history_event, len(payloads))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+def bench_debug_rows(args, results: dict, directory: Path) -> None:
+    event = {
+        "type": "ChatMessage",
+        "platform": "youtube",
+        "data": {"author": "Viewer", "message": "a realistic chat line " * 6, "badges": ["member"], "amount": ""},
+    }
+    sizes = [size for size in DEFAULT_DEBUG_LINES if not (args.quick and size > 10_000)]
+    for size in sizes:
+        name = f"load_debug_rows[{size} lines]"
+        if args.filter and args.filter not in name:
+            continue
+        path = directory / f"debug-{size}.jsonl"
+        with path.open("w", encoding="utf-8") as handle:
+            for index in range(size):
+                handle.write(json.dumps({**event, "loggedAt": 1_700_000_000_000 + index}) + "\n")
+
+        def run_load_debug_rows():
+            for _ in range(DEBUG_LOADS_PER_RUN):
+                history_server.load_debug_rows(path)
+
+        run_benchmark(args, results, name, run_load_debug_rows, DEBUG_LOADS_PER_RUN)
+
+
+def run_benchmark(args, results: dict, name: str, run, ops: int) -> None:
+    if args.filter and args.filter not in name:
+        return
+    results[name] = measure(run, ops, args.repeat)
+    result = results[name]
+    print(f"  {name:<44} {result['bestNsPerOp'] / 1000:10.2f} us/op  (median {result['medianNsPerOp'] / 1000:.2f})")
+
+
+def compare_results(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"\nCompared with baseline from {baseline.get('createdAt', 'unknown')} (threshold {threshold:g}%):")
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"  {name:<44} new")
+            continue
+        change = (result["bestNsPerOp"] - previous["bestNsPerOp"]) / previous["bestNsPerOp"] * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"  {name:<44} {previous['bestNsPerOp'] / 1000:10.2f} -> {result['bestNsPerOp'] / 1000:10.2f} us/op "
+            f"({change:+.1f}%){flag}"
+        )
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.quick:
+        args.repeat = 1
+    results = {}
+    print(f"Python {platform.python_version()}, orjson: {'yes' if history_server.orjson is not None else 'no'}, repeat: {args.repeat}")
+    with tempfile.TemporaryDirectory() as directory:
+        bench_message_paths(args, results, Path(directory))
+        bench_sanitizers(args, results)
+        bench_broadcast(args, results)
+        bench_debug_rows(args, results, Path(directory))
+
+    if args.save:
+        baseline = {
+            "createdAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "orjson": history_server.orjson is not None,
+            "results": results,
+        }
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(baseline, indent=2), encoding="utf-8")
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        try:
+            baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as error:
+            print(f"\nCould not read baseline {args.compare}: {error}")
+            sys.exit(2)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:g}%")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,52 @@
+import asyncio
+import gzip
+import hashlib
+import itertools
 import json
+import math
 import os
+import re
+import shutil
+import signal
 import sqlite3
 import sys
 import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http import HTTPStatus
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
 from pathlib import Path
-from queue import Empty, Queue
-from threading import Lock
+from queue import Empty, Full, Queue
+from threading import Condition, Event, Lock, RLock, Thread
 from urllib.parse import parse_qs, quote, urlparse
 from urllib.request import Request, urlopen
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = ROOT / "data" / "overlay_history.db"
+ARCHIVE_DB_PATH = ROOT / "data" / "overlay_history_archive.db"
 SETTINGS_PATH = ROOT / "data" / "overlay_settings.json"
 RUNTIME_STATE_PATH = ROOT / "data" / "platform_runtime.json"
 TRAIN_STATUS_PATH = ROOT / "data" / "train-status.json"
 TRAIN_ACTIVE_PATH = ROOT / "data" / "train-active.txt"
+STATE_JOURNAL_PATH = ROOT / "data" / "state-journal.jsonl"
+STATE_SNAPSHOT_PATH = ROOT / "data" / "state-snapshot.json"
 YOUTUBE_DEBUG_PATH = ROOT / "data" / "youtube-message-debug.jsonl"
 RUNTIME_DEBUG_PATH = ROOT / "data" / "runtime-debug.jsonl"
 KICK_VIEWER_DEBUG_PATH = ROOT / "data" / "kick-viewer-debug.jsonl"
@@ -26,17 +54,197 @@ KICK_GIFTS_DEBUG_PATH = ROOT / "data" / "kick-gifts-debug.jsonl"
 YOUTUBE_PAID_DEBUG_PATH = ROOT / "data" / "youtube-paid-debug.jsonl"
 GIFT_RECIPIENT_DEBUG_PATH = ROOT / "data" / "gift-recipient-debug.jsonl"
 PARSE_FAILURE_DEBUG_PATH = ROOT / "data" / "parse-failures-debug.jsonl"
+DEBUG_STORE_PATH = ROOT / "data" / "debug_events.db"
+DEBUG_LOG_CHANNELS = {
+    "youtube-message": YOUTUBE_DEBUG_PATH,
+    "runtime": RUNTIME_DEBUG_PATH,
+    "kick-viewer": KICK_VIEWER_DEBUG_PATH,
+    "kick-gifts": KICK_GIFTS_DEBUG_PATH,
+    "youtube-paid": YOUTUBE_PAID_DEBUG_PATH,
+    "gift-recipient": GIFT_RECIPIENT_DEBUG_PATH,
+    "parse-failures": PARSE_FAILURE_DEBUG_PATH,
+}
 DB_LOCK = Lock()
-STREAM_LOCK = Lock()
-STREAM_SUBSCRIBERS = set()
-TWITCH_AVATAR_CACHE = {}
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_SEC = 5
+DB_POOL = Queue(maxsize=DB_POOL_SIZE)
+SQLITE_INT_MIN = -(2**63)
+SQLITE_INT_MAX = 2**63 - 1
+HISTORY_PAGE_LIMIT = 2000
+HISTORY_BATCH_LIMIT = 500
+DEDUPE_WINDOW_MS = 1000
+DEDUPE_BACKFILL_BATCH_SIZE = 5000
+HISTORY_SELECT_COLUMNS = """
+    m.id, m.platform, m.variant, m.username, m.text, m.color,
+    COALESCE(NULLIF(u.avatar_url, ''), m.avatar_url) AS avatar_url, m.is_broadcaster,
+    m.timestamp_ms, m.badges_json, m.amount_text, m.tone, m.member_label, m.message_id, m.user_id,
+    m.gift_id, m.gift_name, m.gift_image_url, m.gift_image_ref, m.content_parts_json
+"""
+HISTORY_SELECT_FROM = "messages AS m LEFT JOIN users AS u ON u.id = m.user_ref"
+USER_BACKFILL_BATCH_SIZE = 5000
+INTERN_TABLES = {"badges": "name", "image_urls": "url"}
+INTERN_LOCK = Lock()
+INTERNED_IDS = {table: {} for table in INTERN_TABLES}
+INTERNED_VALUES = {table: {} for table in INTERN_TABLES}
+STREAM_LOCK = RLock()
+STREAM_CONDITION = Condition(STREAM_LOCK)
+STREAM_EVENT_BUFFER_SIZE = 1024
+STREAM_EVENTS = deque(maxlen=STREAM_EVENT_BUFFER_SIZE)
+STREAM_SEQUENCE = 0
+STREAM_SUBSCRIBERS = {}
+STREAM_SUBSCRIBER_TOPICS = {}
+STREAM_DEFAULT_TOPICS = frozenset({"history", "settings"})
+STREAM_LISTENERS = []
+STREAM_KEEPALIVE_SEC = 20
+STREAM_RESYNC_MESSAGE = json.dumps({"type": "resync"})
+HISTORY_RETENTION_BATCH_SIZE = 5000
+HISTORY_MAX_ROWS_PER_PLATFORM = 20000
+HISTORY_PLATFORMS = ("twitch", "kick", "youtube")
+HISTORY_VACUUM_PAGES = 2000
+RETENTION_STOP = Event()
+STATE_WATCH_STOP = Event()
+STATE_WATCH_INTERVAL_SEC = 1.0
+STATE_WATCHER_RUNNING = False
+STATE_LOCK = RLock()
+STATE_TOPICS = {
+    "settings": {"path": SETTINGS_PATH, "signature": None, "value": None, "durable": True, "exported": 0},
+    "runtime": {"path": RUNTIME_STATE_PATH, "signature": None, "value": None, "durable": False, "exported": 0},
+    "train": {"path": TRAIN_STATUS_PATH, "signature": None, "value": None, "durable": True, "exported": 0},
+}
+STATE_JOURNAL = {"handle": None, "entries": 0, "loaded": False}
+STATE_JOURNAL_COMPACT_ENTRIES = 256
+DEBUG_LOG_QUEUE = None
+DEBUG_LOG_THREAD = None
+DEBUG_LOG_QUEUE_SIZE = 10000
+DEBUG_LOG_FLUSH_SEC = 1.0
+DEBUG_LOG_TAIL_ROWS = 200
+DEBUG_LOG_TAIL_BLOCK_BYTES = 64 * 1024
+DEBUG_LOG_WRITE_BUFFER_BYTES = 64 * 1024
+DEBUG_QUERY_PARAMS = {"from", "to", "limit", "cursor"}
+DEBUG_QUERY_DEFAULT_LIMIT = 1000
+DEBUG_QUERY_MAX_LIMIT = 1000000
+DEBUG_QUERY_CHUNK_ROWS = 500
+DEBUG_STORE_PRUNE_INTERVAL_SEC = 3600
+LOG_QUEUE = None
+LOG_THREAD = None
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_LINES = 500
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_LEVEL = LOG_LEVELS["info"]
+ACCESS_LOG_SLOW_MS = 1000
+ACCESS_LOG_SAMPLE_RATES = {
+    ("GET", "/api/history"): 100,
+    ("GET", "/api/settings"): 100,
+    ("GET", "/api/runtime-state"): 100,
+    ("GET", "/api/train-status"): 100,
+    ("POST", "/api/runtime-state"): 100,
+    ("GET", "/api/metrics"): 100,
+}
+ACCESS_LOG_SAMPLE_LOCK = Lock()
+ACCESS_LOG_SAMPLE_COUNTS = {}
+REQUEST_RING_SIZE = 500
+REQUEST_RING = deque(maxlen=REQUEST_RING_SIZE)
+ASYNC_EXECUTOR_WORKERS = 8
+ASYNC_REQUEST_TIMEOUT_SEC = 30
+ASYNC_RESPONSE_FLUSH_BYTES = 64 * 1024
+ASYNC_STREAM_WAKEUP = None
+HISTORY_WRITE_QUEUE_TIMEOUT_SEC = 0.5
+HISTORY_WRITE_QUEUE = None
+HISTORY_WRITER_THREAD = None
+HISTORY_WRITE_SEQUENCE = itertools.count(1)
+HISTORY_WRITE_SEQUENCE_LOCK = Lock()
+COMPRESSIBLE_CONTENT_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+STATIC_COMPRESSION_MIN_BYTES = 1024
+JSON_COMPRESSION_MIN_BYTES = 4096
+JSON_STREAM_CHUNK_BYTES = 64 * 1024
+MESSAGE_JSON_LOCK = Lock()
+MESSAGE_JSON_CACHE = OrderedDict()
+MESSAGE_JSON_CACHE_MAX_ENTRIES = 60000
+STATIC_CACHE_MAX_BYTES = 48 * 1024 * 1024
+STATIC_CACHE_MAX_FILE_BYTES = 8 * 1024 * 1024
+STATIC_CACHE_LOCK = Lock()
+STATIC_CACHE = OrderedDict()
+STATIC_CACHE_BYTES = 0
+STORE_VERSION_LOCK = Lock()
+METRICS_LOCK = Lock()
+METRICS_COUNTERS = {}
+METRICS_HISTOGRAMS = {}
+METRICS_STARTED_AT = time.monotonic()
+METRICS_BUCKETS_SEC = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+METRICS_METHODS = {"GET", "HEAD", "POST"}
+METRICS_ROUTES = {
+    "/api/history",
+    "/api/history/batch",
+    "/api/history/stream",
+    "/api/settings",
+    "/api/runtime-state",
+    "/api/train-status",
+    "/api/twitch/avatar",
+    "/api/twitch/avatars",
+    "/api/metrics",
+    "/api/debug/requests",
+}
+METRICS_STREAM_LABELS = (("route", "/api/history/stream"),)
+METRICS_SQL_LABELS = {}
+METRICS_SQL_LABEL_LIMIT = 1024
+METRICS_SQL_TABLE_PATTERN = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([\w.]+)",
+    re.IGNORECASE,
+)
+METRICS_DESCRIPTIONS = {
+    "chatbox_http_requests_total": ("counter", "HTTP requests by method, route and status."),
+    "chatbox_http_request_seconds": ("histogram", "HTTP request handling time by method and route."),
+    "chatbox_http_response_bytes_total": ("counter", "Response body bytes sent by route."),
+    "chatbox_lock_wait_seconds": ("histogram", "Time spent waiting to acquire a server lock."),
+    "chatbox_lock_hold_seconds": ("histogram", "Time a server lock was held."),
+    "chatbox_sqlite_statement_seconds": ("histogram", "SQLite statement time by operation and table."),
+    "chatbox_twitch_lookup_seconds": ("histogram", "Twitch users API lookup time by result."),
+    "chatbox_cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "chatbox_cache_hit_ratio": ("gauge", "Share of cache lookups that were hits."),
+    "chatbox_stream_subscribers": ("gauge", "Open live history stream connections."),
+    "chatbox_stream_subscriber_backlog_events": ("gauge", "Stream events a subscriber has not read yet."),
+    "chatbox_stream_buffered_events": ("gauge", "Events kept in the stream replay buffer."),
+    "chatbox_queue_depth": ("gauge", "Items waiting in a background queue."),
+    "chatbox_db_pool_idle_connections": ("gauge", "Idle SQLite connections in the pool."),
+    "chatbox_uptime_seconds": ("gauge", "Seconds since the server started."),
+    "chatbox_log_dropped_total": ("counter", "Log lines dropped because the log queue was full."),
+}
+STORE_VERSIONS = {"history": 0, "settings": 0, "runtime": 0, "train": 0}
+SERVER_BOOT_ID = format(time.time_ns() // 1_000_000, "x")
+TWITCH_API_BASE_URL = "https://api.twitch.tv/helix"
+TWITCH_AVATAR_LOCK = Lock()
+TWITCH_AVATAR_CACHE = OrderedDict()
+TWITCH_AVATAR_CACHE_MAX_ENTRIES = 2048
 TWITCH_AVATAR_CACHE_TTL_SEC = 60 * 60 * 6
+TWITCH_AVATAR_NEGATIVE_TTL_SEC = 60 * 10
+TWITCH_AVATAR_STORE_MAX_ROWS = 20000
+TWITCH_AVATAR_INFLIGHT = {}
+TWITCH_LOOKUP_TIMEOUT_SEC = 10
+TWITCH_BATCH_CONDITION = Condition(TWITCH_AVATAR_LOCK)
+TWITCH_BATCH_PENDING = []
+TWITCH_BATCH_WINDOW_SEC = 0.025
+TWITCH_BATCH_MAX_LOGINS = 100
+TWITCH_AVATARS_REQUEST_MAX_LOGINS = 500
 
 
 def init_db() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with DB_LOCK:
-        connection = sqlite3.connect(DB_PATH)
+    with DB_LOCK, db_connection() as connection:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("VACUUM")
+        connection.execute("PRAGMA journal_mode=WAL")
         connection.execute(
             """
             CREATE TABLE IF NOT EXISTS messages (
@@ -70,6 +278,18 @@ def init_db() -> None:
         ensure_column(connection, "messages", "gift_id", "TEXT")
         ensure_column(connection, "messages", "gift_name", "TEXT")
         ensure_column(connection, "messages", "gift_image_url", "TEXT")
+        ensure_column(connection, "messages", "dedupe_key", "INTEGER")
+        ensure_column(connection, "messages", "user_ref", "INTEGER REFERENCES users(id)")
+        ensure_column(connection, "messages", "gift_image_ref", "INTEGER REFERENCES image_urls(id)")
+        for table, column in INTERN_TABLES.items():
+            connection.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY,
+                    {column} TEXT NOT NULL UNIQUE
+                )
+                """
+            )
         connection.execute(
             """
             CREATE TABLE IF NOT EXISTS removed_messages (
@@ -83,29 +303,290 @@ def init_db() -> None:
         connection.execute(
             "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp_ms)"
         )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_platform_timestamp ON messages(platform, timestamp_ms)"
+        )
         connection.execute(
             "CREATE INDEX IF NOT EXISTS idx_removed_messages_lookup ON removed_messages(platform, message_id)"
         )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS twitch_avatars (
+                login TEXT PRIMARY KEY,
+                avatar_url TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL,
+                fetched_at_ms INTEGER NOT NULL,
+                last_used_ms INTEGER NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_twitch_avatars_last_used ON twitch_avatars(last_used_ms)"
+        )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                platform TEXT NOT NULL,
+                user_id TEXT NOT NULL DEFAULT '',
+                login TEXT NOT NULL,
+                avatar_url TEXT NOT NULL DEFAULT '',
+                updated_at_ms INTEGER NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_users_platform_user_id
+            ON users(platform, user_id)
+            WHERE user_id <> ''
+            """
+        )
+        connection.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_users_platform_anonymous_login
+            ON users(platform, login)
+            WHERE user_id = ''
+            """
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_users_platform_login ON users(platform, login)")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_ref ON messages(user_ref)")
+        migrate_dedupe_keys(connection)
+        migrate_user_refs(connection)
         connection.commit()
+
+
+def migrate_dedupe_keys(connection: sqlite3.Connection) -> None:
+    while True:
+        rows = connection.execute(
+            """
+            SELECT id, platform, variant, username, text, amount_text, tone, timestamp_ms
+            FROM messages
+            WHERE dedupe_key IS NULL
+            LIMIT ?
+            """,
+            (DEDUPE_BACKFILL_BATCH_SIZE,),
+        ).fetchall()
+        if not rows:
+            break
+        connection.executemany(
+            "UPDATE messages SET dedupe_key = ? WHERE id = ?",
+            [
+                (
+                    build_dedupe_key(
+                        row["platform"],
+                        row["variant"],
+                        row["username"],
+                        row["text"],
+                        row["amount_text"],
+                        row["tone"],
+                        row["timestamp_ms"] // DEDUPE_WINDOW_MS,
+                    ),
+                    row["id"],
+                )
+                for row in rows
+            ],
+        )
+
+    has_unique_index = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_messages_platform_message_id'"
+    ).fetchone()
+    if not has_unique_index:
+        connection.execute(
+            """
+            DELETE FROM messages
+            WHERE COALESCE(message_id, '') <> ''
+              AND id NOT IN (
+                  SELECT MIN(id)
+                  FROM messages
+                  WHERE COALESCE(message_id, '') <> ''
+                  GROUP BY platform, message_id
+              )
+            """
+        )
+        connection.execute(
+            """
+            CREATE UNIQUE INDEX idx_messages_platform_message_id
+            ON messages(platform, message_id)
+            WHERE message_id IS NOT NULL AND message_id <> ''
+            """
+        )
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_messages_dedupe_key ON messages(dedupe_key)")
+
+
+def migrate_user_refs(connection: sqlite3.Connection) -> None:
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            """
+            SELECT id, platform, username, user_id, avatar_url
+            FROM messages
+            WHERE user_ref IS NULL AND id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (last_id, USER_BACKFILL_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            user_ref = upsert_user(connection, row["platform"], row["user_id"], row["username"], row["avatar_url"])
+            if user_ref is not None:
+                updates.append((user_ref, row["id"]))
+        connection.executemany("UPDATE messages SET user_ref = ? WHERE id = ?", updates)
+        last_id = rows[-1]["id"]
+
+
+def upsert_user(
+    connection: sqlite3.Connection,
+    platform: str,
+    user_id: str | None,
+    username: str | None,
+    avatar_url: str | None = "",
+) -> int | None:
+    user_id = str(user_id or "").strip()
+    login = str(username or "").strip().lower()
+    if not user_id and not login:
+        return None
+
+    key_column = "user_id" if user_id else "login"
+    key_filter = "user_id <> ''" if user_id else "user_id = ''"
+    connection.execute(
+        f"""
+        INSERT INTO users (platform, user_id, login, avatar_url, updated_at_ms)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(platform, {key_column}) WHERE {key_filter} DO UPDATE SET
+            login = excluded.login,
+            avatar_url = CASE WHEN excluded.avatar_url <> '' THEN excluded.avatar_url ELSE users.avatar_url END,
+            updated_at_ms = excluded.updated_at_ms
+        WHERE users.login <> excluded.login
+           OR (excluded.avatar_url <> '' AND users.avatar_url <> excluded.avatar_url)
+        """,
+        (platform, user_id, login, str(avatar_url or "").strip(), int(time.time() * 1000)),
+    )
+    row = connection.execute(
+        f"SELECT id FROM users WHERE platform = ? AND {key_column} = ? AND {key_filter}",
+        (platform, user_id or login),
+    ).fetchone()
+    return row[0]
+
+
+class MeasuredConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_metric("chatbox_sqlite_statement_seconds", sqlite_statement_labels(sql), time.perf_counter() - started)
+
+    def executemany(self, sql, parameters, /):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            observe_metric("chatbox_sqlite_statement_seconds", sqlite_statement_labels(sql), time.perf_counter() - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            observe_metric("chatbox_sqlite_statement_seconds", (("statement", "commit"),), time.perf_counter() - started)
+
+
+class MeasuredLock:
+    def __init__(self, name: str, lock):
+        self.lock = lock
+        self.labels = (("lock", name),)
+        self.reentrant = hasattr(lock, "_is_owned")
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.reentrant and self.lock._is_owned():
+            return self.lock.acquire(blocking, timeout)
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+            observe_metric("chatbox_lock_wait_seconds", self.labels, self.acquired_at - started)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        if not (self.reentrant and self.lock._is_owned()):
+            observe_metric("chatbox_lock_hold_seconds", self.labels, held)
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _is_owned(self):
+        return self.lock._is_owned()
+
+    def _release_save(self):
+        observe_metric("chatbox_lock_hold_seconds", self.labels, time.perf_counter() - self.acquired_at)
+        return self.lock._release_save()
+
+    def _acquire_restore(self, state):
+        started = time.perf_counter()
+        self.lock._acquire_restore(state)
+        self.acquired_at = time.perf_counter()
+        observe_metric("chatbox_lock_wait_seconds", self.labels, self.acquired_at - started)
+
+
+def open_db_connection() -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_SEC,
+        check_same_thread=False,
+        factory=MeasuredConnection,
+    )
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+@contextmanager
+def db_connection():
+    try:
+        connection = DB_POOL.get_nowait()
+    except Empty:
+        connection = open_db_connection()
+
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        forget_interned_values()
+        raise
+    finally:
+        try:
+            DB_POOL.put_nowait(connection)
+        except Full:
+            connection.close()
+
+
+def close_db_pool() -> None:
+    while True:
+        try:
+            connection = DB_POOL.get_nowait()
+        except Empty:
+            return
         connection.close()
-    init_settings_store()
 
 
-def init_settings_store() -> None:
-    SETTINGS_PATH.parent.mkdir(parents=True, exist_ok=True)
-    if SETTINGS_PATH.exists():
-        init_train_status_store()
-        return
-    SETTINGS_PATH.write_text("{}", encoding="utf-8")
-    init_train_status_store()
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in {"1", "true", "yes", "on"}
 
 
-def init_train_status_store() -> None:
-    TRAIN_STATUS_PATH.parent.mkdir(parents=True, exist_ok=True)
-    if not TRAIN_STATUS_PATH.exists():
-        save_train_status({})
-    if not TRAIN_ACTIVE_PATH.exists():
-        TRAIN_ACTIVE_PATH.write_text("0", encoding="utf-8")
+def env_int(name: str, fallback: int) -> int:
+    try:
+        return int(os.environ.get(name, "").strip() or fallback)
+    except ValueError:
+        return fallback
 
 
 def ensure_column(connection: sqlite3.Connection, table_name: str, column_name: str, column_type: str) -> None:
@@ -118,6 +599,73 @@ def ensure_column(connection: sqlite3.Connection, table_name: str, column_name:
     connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
 
 
+def intern_value(connection: sqlite3.Connection, table: str, value: str) -> int:
+    ident = INTERNED_IDS[table].get(value)
+    if ident is not None:
+        record_cache_lookups("intern", 1, 0)
+        return ident
+
+    record_cache_lookups("intern", 0, 1)
+    column = INTERN_TABLES[table]
+    connection.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,))
+    ident = connection.execute(f"SELECT id FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+    with INTERN_LOCK:
+        INTERNED_IDS[table][value] = ident
+        INTERNED_VALUES[table][ident] = value
+    return ident
+
+
+def resolve_interned(table: str, ident: int) -> str:
+    value = INTERNED_VALUES[table].get(ident)
+    if value is not None:
+        return value
+
+    with db_connection() as connection:
+        rows = connection.execute(f"SELECT id, {INTERN_TABLES[table]} FROM {table}").fetchall()
+    with INTERN_LOCK:
+        for row_id, row_value in rows:
+            INTERNED_IDS[table][row_value] = row_id
+            INTERNED_VALUES[table][row_id] = row_value
+    return INTERNED_VALUES[table].get(ident, "")
+
+
+def forget_interned_values() -> None:
+    with INTERN_LOCK:
+        for table in INTERN_TABLES:
+            INTERNED_IDS[table] = {}
+            INTERNED_VALUES[table] = {}
+
+
+def encode_badges(connection: sqlite3.Connection, badges: list) -> str:
+    return json.dumps([intern_value(connection, "badges", badge) for badge in badges], separators=(",", ":"))
+
+
+def decode_badges(badges_json: str | None) -> list:
+    return [
+        resolve_interned("badges", badge) if isinstance(badge, int) else badge
+        for badge in json.loads(badges_json or "[]")
+    ]
+
+
+def encode_content_parts(connection: sqlite3.Connection, content_parts: list) -> str:
+    encoded = []
+    for part in content_parts:
+        image_url = part.get("imageUrl")
+        if isinstance(image_url, str) and image_url:
+            part = {key: value for key, value in part.items() if key != "imageUrl"}
+            part["imageRef"] = intern_value(connection, "image_urls", image_url)
+        encoded.append(part)
+    return json.dumps(encoded, ensure_ascii=True, separators=(",", ":"))
+
+
+def decode_content_parts(content_parts_json: str | None) -> list:
+    content_parts = json.loads(content_parts_json or "[]")
+    for part in content_parts:
+        if isinstance(part, dict) and "imageRef" in part:
+            part["imageUrl"] = resolve_interned("image_urls", part.pop("imageRef"))
+    return content_parts
+
+
 def row_to_message(row: sqlite3.Row) -> dict:
     return {
         "platform": row["platform"],
@@ -130,14 +678,16 @@ def row_to_message(row: sqlite3.Row) -> dict:
         "userId": row["user_id"] or "",
         "isBroadcaster": bool(row["is_broadcaster"]),
         "timestamp": row["timestamp_ms"],
-        "badges": json.loads(row["badges_json"] or "[]"),
+        "badges": decode_badges(row["badges_json"]),
         "amountText": row["amount_text"] or "",
         "tone": row["tone"] or "",
         "memberLabel": row["member_label"] or "",
         "giftId": row["gift_id"] or "",
         "giftName": row["gift_name"] or "",
-        "giftImageUrl": row["gift_image_url"] or "",
-        "contentParts": json.loads(row["content_parts_json"] or "[]"),
+        "giftImageUrl": (
+            resolve_interned("image_urls", row["gift_image_ref"]) if row["gift_image_ref"] else row["gift_image_url"] or ""
+        ),
+        "contentParts": decode_content_parts(row["content_parts_json"]),
     }
 
 
@@ -145,16 +695,46 @@ class OverlayHandler(SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=str(ROOT), **kwargs)
 
+    def handle_one_request(self):
+        self._metrics_status = 0
+        self._metrics_bytes = 0
+        started = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            if self._metrics_status:
+                record_request(
+                    self.command,
+                    getattr(self, "path", ""),
+                    self._metrics_status,
+                    time.perf_counter() - started,
+                    self._metrics_bytes,
+                    self.address_string(),
+                )
+
+    def send_response(self, code, message=None):
+        self._metrics_status = int(code)
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "cache-control":
+            self._cache_control_sent = True
+        elif keyword.lower() == "content-length" and self.command != "HEAD":
+            self._metrics_bytes = int(value)
+        super().send_header(keyword, value)
+
     def end_headers(self):
-        self.send_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
-        self.send_header("Pragma", "no-cache")
-        self.send_header("Expires", "0")
+        if not getattr(self, "_cache_control_sent", False) and urlparse(self.path).path.startswith("/api/"):
+            self.send_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
+            self.send_header("Pragma", "no-cache")
+            self.send_header("Expires", "0")
+        self._cache_control_sent = False
         super().end_headers()
 
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == "/api/history":
-            self.handle_history_get()
+            self.handle_history_get(parsed)
             return
         if parsed.path == "/api/settings":
             self.handle_settings_get()
@@ -165,33 +745,24 @@ class OverlayHandler(SimpleHTTPRequestHandler):
         if parsed.path == "/api/train-status":
             self.handle_train_status_get()
             return
-        if parsed.path == "/api/debug/youtube-message":
-            self.handle_youtube_debug_get()
-            return
-        if parsed.path == "/api/debug/runtime":
-            self.handle_runtime_debug_get()
-            return
-        if parsed.path == "/api/debug/kick-viewer":
-            self.handle_kick_viewer_debug_get()
-            return
-        if parsed.path == "/api/debug/kick-gifts":
-            self.send_json(load_debug_rows(KICK_GIFTS_DEBUG_PATH))
+        if parsed.path == "/api/debug/requests":
+            self.handle_request_ring_get(parsed)
             return
-        if parsed.path == "/api/debug/youtube-paid":
-            self.send_json(load_debug_rows(YOUTUBE_PAID_DEBUG_PATH))
-            return
-        if parsed.path == "/api/debug/gift-recipient":
-            self.send_json(load_debug_rows(GIFT_RECIPIENT_DEBUG_PATH))
-            return
-        if parsed.path == "/api/debug/parse-failures":
-            self.send_json(load_debug_rows(PARSE_FAILURE_DEBUG_PATH))
+        if parsed.path.startswith("/api/debug/") and parsed.path[11:] in DEBUG_LOG_CHANNELS:
+            self.handle_debug_get(parsed.path[11:], parsed)
             return
         if parsed.path == "/api/history/stream":
-            self.handle_history_stream()
+            self.handle_history_stream(parsed)
             return
         if parsed.path == "/api/twitch/avatar":
             self.handle_twitch_avatar_get(parsed)
             return
+        if parsed.path == "/api/twitch/avatars":
+            self.handle_twitch_avatars_get(parsed)
+            return
+        if parsed.path == "/api/metrics":
+            self.handle_metrics_get(parsed)
+            return
         super().do_GET()
 
     def do_POST(self):
@@ -199,6 +770,9 @@ class OverlayHandler(SimpleHTTPRequestHandler):
         if parsed.path == "/api/history":
             self.handle_history_post()
             return
+        if parsed.path == "/api/history/batch":
+            self.handle_history_batch_post()
+            return
         if parsed.path == "/api/settings":
             self.handle_settings_post()
             return
@@ -208,45 +782,43 @@ class OverlayHandler(SimpleHTTPRequestHandler):
         if parsed.path == "/api/train-status":
             self.handle_train_status_post()
             return
-        if parsed.path == "/api/debug/youtube-message":
-            self.handle_youtube_debug_post()
-            return
-        if parsed.path == "/api/debug/runtime":
-            self.handle_runtime_debug_post()
-            return
-        if parsed.path == "/api/debug/kick-viewer":
-            self.handle_kick_viewer_debug_post()
-            return
-        if parsed.path == "/api/debug/kick-gifts":
-            self.handle_debug_append(KICK_GIFTS_DEBUG_PATH)
-            return
-        if parsed.path == "/api/debug/youtube-paid":
-            self.handle_debug_append(YOUTUBE_PAID_DEBUG_PATH)
-            return
-        if parsed.path == "/api/debug/gift-recipient":
-            self.handle_debug_append(GIFT_RECIPIENT_DEBUG_PATH)
-            return
-        if parsed.path == "/api/debug/parse-failures":
-            self.handle_debug_append(PARSE_FAILURE_DEBUG_PATH)
+        if parsed.path.startswith("/api/debug/") and parsed.path[11:] in DEBUG_LOG_CHANNELS:
+            self.handle_debug_append(parsed.path[11:])
             return
         self.send_error(HTTPStatus.NOT_FOUND, "Not found")
 
-    def handle_history_get(self):
-        with DB_LOCK:
-            connection = sqlite3.connect(DB_PATH)
-            connection.row_factory = sqlite3.Row
-            rows = connection.execute(
-                """
-                SELECT platform, variant, username, text, color, avatar_url, is_broadcaster,
-                       timestamp_ms, badges_json, amount_text, tone, member_label, message_id, user_id,
-                       gift_id, gift_name, gift_image_url, content_parts_json
-                FROM messages
-                ORDER BY timestamp_ms ASC, id ASC
-                """
-            ).fetchall()
-            connection.close()
-
-        self.send_json([row_to_message(row) for row in rows])
+    def handle_history_get(self, parsed):
+        params = parse_qs(parsed.query or "")
+        paged = any(key in params for key in ("since", "removedSince", "limit", "tail"))
+        if paged:
+            query = {
+                "since": parse_query_int(params, "since") if "since" in params else None,
+                "removed_since": parse_query_int(params, "removedSince") if "removedSince" in params else None,
+                "limit": min(parse_query_int(params, "limit"), HISTORY_PAGE_LIMIT),
+                "tail": parse_query_int(params, "tail"),
+            }
+            query_key = ".".join("" if value is None else str(value) for value in query.values())
+        else:
+            query_key = "all"
+        revision = get_store_version("history")
+        with db_connection() as connection:
+            etag = self.encoded_etag(build_etag("history", *load_history_version(connection), revision, query_key))
+            if self.etag_matches(etag):
+                payload = None
+            elif not paged:
+                rows = connection.execute(
+                    f"SELECT {HISTORY_SELECT_COLUMNS} FROM {HISTORY_SELECT_FROM} ORDER BY m.timestamp_ms ASC, m.id ASC"
+                ).fetchall()
+                payload = [b"[", *join_json_fragments(encode_message_rows(rows)), b"]"]
+            else:
+                page = load_history_page(connection, **query, encode_messages=True)
+                messages = page.pop("messages")
+                payload = [b'{"messages":[', *join_json_fragments(messages), b"],", encode_json(page)[1:]]
+
+        if payload is None:
+            self.send_not_modified(etag)
+            return
+        self.send_json_fragments(payload, etag=etag)
 
     def handle_history_post(self):
         content_length = int(self.headers.get("Content-Length", "0"))
@@ -266,51 +838,54 @@ class OverlayHandler(SimpleHTTPRequestHandler):
             self.send_json({"error": "Invalid message payload"}, status=HTTPStatus.BAD_REQUEST)
             return
 
-        badges_json = json.dumps(payload.get("badges", []), ensure_ascii=True)
-        content_parts_json = json.dumps(payload.get("contentParts", []), ensure_ascii=True)
-
-        with DB_LOCK:
-            connection = sqlite3.connect(DB_PATH)
-            if is_duplicate_message(connection, payload):
-                connection.close()
-                self.send_json({"status": "duplicate"})
+        if HISTORY_WRITE_QUEUE is not None:
+            sequence = enqueue_history_write(payload)
+            if sequence is None:
+                self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
                 return
+            self.send_json({"status": "queued", "sequence": sequence}, status=HTTPStatus.ACCEPTED)
+            return
 
-            connection.execute(
-                """
-                INSERT INTO messages (
-                    platform, variant, username, text, color, avatar_url, is_broadcaster,
-                    timestamp_ms, badges_json, amount_text, tone, member_label, message_id, user_id,
-                    gift_id, gift_name, gift_image_url, content_parts_json
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    payload["platform"],
-                    payload.get("variant", "chat"),
-                    payload["username"],
-                    payload["text"],
-                    payload.get("color"),
-                    payload.get("avatarUrl", ""),
-                    1 if payload.get("isBroadcaster") else 0,
-                    int(payload["timestamp"]),
-                    badges_json,
-                    payload.get("amountText", ""),
-                    payload.get("tone", ""),
-                    payload.get("memberLabel", ""),
-                    payload.get("messageId", ""),
-                    payload.get("userId", ""),
-                    payload.get("giftId", ""),
-                    payload.get("giftName", ""),
-                    payload.get("giftImageUrl", ""),
-                    content_parts_json,
-                ),
-            )
+        with DB_LOCK, db_connection() as connection:
+            duplicate = insert_history_message(connection, payload) is None
             connection.commit()
-            connection.close()
+
+        if duplicate:
+            self.send_json({"status": "duplicate"})
+            return
 
         broadcast_history_event({"type": "message", "message": payload})
         self.send_json({"status": "ok"})
 
+    def handle_history_batch_post(self):
+        content_length = int(self.headers.get("Content-Length", "0"))
+        raw_body = self.rfile.read(content_length) if content_length > 0 else b""
+
+        try:
+            payload = json.loads(raw_body.decode("utf-8"))
+        except json.JSONDecodeError:
+            self.send_json({"error": "Invalid JSON"}, status=HTTPStatus.BAD_REQUEST)
+            return
+
+        items = payload.get("messages") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            self.send_json({"error": "Invalid batch payload"}, status=HTTPStatus.BAD_REQUEST)
+            return
+        if len(items) > HISTORY_BATCH_LIMIT:
+            self.send_json(
+                {"error": f"Batch exceeds {HISTORY_BATCH_LIMIT} messages"},
+                status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+            )
+            return
+
+        results, inserted = insert_history_batch(items)
+        if inserted:
+            broadcast_history_event({"type": "batch", "messages": inserted})
+        self.send_json({"status": "ok", "results": results})
+
     def handle_history_remove(self, payload):
         platform = str(payload.get("platform", "") or "").strip().lower()
         message_id = str(payload.get("messageId", "") or "").strip()
@@ -320,8 +895,7 @@ class OverlayHandler(SimpleHTTPRequestHandler):
 
         removed_at_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
 
-        with DB_LOCK:
-            connection = sqlite3.connect(DB_PATH)
+        with DB_LOCK, db_connection() as connection:
             connection.execute(
                 """
                 INSERT INTO removed_messages (platform, message_id, removed_at_ms)
@@ -338,15 +912,16 @@ class OverlayHandler(SimpleHTTPRequestHandler):
                 (platform, message_id),
             )
             connection.commit()
-            connection.close()
 
         broadcast_history_event({"type": "remove", "platform": platform, "messageId": message_id})
         self.send_json({"status": "ok"})
 
-    def handle_history_stream(self):
-        queue = Queue()
-        with STREAM_LOCK:
-            STREAM_SUBSCRIBERS.add(queue)
+    def handle_history_stream(self, parsed):
+        params = parse_qs(parsed.query or "")
+        last_event_id = self.headers.get("Last-Event-ID", "") or first_query_value(params, "lastEventId")
+        topics = parse_stream_topics(params)
+        token = object()
+        cursor, resync = open_stream_cursor(token, last_event_id, topics)
 
         self.send_response(HTTPStatus.OK)
         self.send_header("Content-Type", "text/event-stream; charset=utf-8")
@@ -355,24 +930,33 @@ class OverlayHandler(SimpleHTTPRequestHandler):
         self.end_headers()
 
         try:
-            self.wfile.write(b": connected\n\n")
-            self.wfile.flush()
+            chunk = b"retry: 3000\n: connected\n\n"
+            if resync:
+                chunk += format_stream_event(cursor, STREAM_RESYNC_MESSAGE)
+            chunk += format_state_snapshot(cursor, topics)
 
             while True:
-                try:
-                    payload = queue.get(timeout=20)
-                    self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
-                except Empty:
-                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.write(chunk)
                 self.wfile.flush()
+                increment_metric("chatbox_http_response_bytes_total", METRICS_STREAM_LABELS, len(chunk))
+                events, next_cursor, lagged = read_stream_events(token, cursor, STREAM_KEEPALIVE_SEC, topics)
+                while not lagged and not events and next_cursor != cursor:
+                    cursor = next_cursor
+                    events, next_cursor, lagged = read_stream_events(token, cursor, STREAM_KEEPALIVE_SEC, topics)
+                if lagged:
+                    chunk = format_stream_event(next_cursor, STREAM_RESYNC_MESSAGE)
+                elif events:
+                    chunk = b"".join(format_stream_event(sequence, message) for sequence, message in events)
+                else:
+                    chunk = b": keepalive\n\n"
+                cursor = next_cursor
         except (BrokenPipeError, ConnectionResetError):
             pass
         finally:
-            with STREAM_LOCK:
-                STREAM_SUBSCRIBERS.discard(queue)
+            close_stream_cursor(token)
 
     def handle_settings_get(self):
-        self.send_json(load_overlay_settings())
+        self.send_state_topic("settings")
 
     def handle_settings_post(self):
         content_length = int(self.headers.get("Content-Length", "0"))
@@ -388,13 +972,11 @@ class OverlayHandler(SimpleHTTPRequestHandler):
             self.send_json({"error": "Invalid settings payload"}, status=HTTPStatus.BAD_REQUEST)
             return
 
-        settings = sanitize_overlay_settings(payload)
-        save_overlay_settings(settings)
-        broadcast_history_event({"type": "settings", "settings": settings})
-        self.send_json({"status": "ok", "settings": settings})
+        settings, version, _ = set_state_topic("settings", payload)
+        self.send_json({"status": "ok", "settings": settings, "version": version})
 
     def handle_runtime_state_get(self):
-        self.send_json(load_runtime_state())
+        self.send_state_topic("runtime")
 
     def handle_runtime_state_post(self):
         content_length = int(self.headers.get("Content-Length", "0"))
@@ -410,69 +992,11 @@ class OverlayHandler(SimpleHTTPRequestHandler):
             self.send_json({"error": "Invalid runtime payload"}, status=HTTPStatus.BAD_REQUEST)
             return
 
-        runtime = sanitize_runtime_state(payload)
-        save_runtime_state(runtime)
-        self.send_json({"status": "ok", "runtime": runtime})
-
-    def handle_youtube_debug_get(self):
-        if not YOUTUBE_DEBUG_PATH.exists():
-            self.send_json([])
-            return
-
-        rows = []
-        try:
-            for line in YOUTUBE_DEBUG_PATH.read_text(encoding="utf-8").splitlines()[-200:]:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    rows.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
-        except OSError:
-            rows = []
-
-        self.send_json(rows)
-
-    def handle_youtube_debug_post(self):
-        content_length = int(self.headers.get("Content-Length", "0"))
-        raw_body = self.rfile.read(content_length) if content_length > 0 else b""
-
-        try:
-            payload = json.loads(raw_body.decode("utf-8"))
-        except json.JSONDecodeError:
-            self.send_json({"error": "Invalid JSON"}, status=HTTPStatus.BAD_REQUEST)
-            return
-
-        if not isinstance(payload, dict):
-            self.send_json({"error": "Invalid payload"}, status=HTTPStatus.BAD_REQUEST)
-            return
-
-        payload["loggedAt"] = int(datetime.now(timezone.utc).timestamp() * 1000)
-        YOUTUBE_DEBUG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        try:
-            with YOUTUBE_DEBUG_PATH.open("a", encoding="utf-8") as handle:
-                handle.write(json.dumps(payload, ensure_ascii=False) + "\n")
-        except OSError:
-            self.send_json({"error": "Could not write debug log"}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
-            return
-
-        self.send_json({"status": "ok"})
-
-    def handle_runtime_debug_get(self):
-        self.send_json(load_debug_rows(RUNTIME_DEBUG_PATH))
-
-    def handle_runtime_debug_post(self):
-        self.handle_debug_append(RUNTIME_DEBUG_PATH)
-
-    def handle_kick_viewer_debug_get(self):
-        self.send_json(load_debug_rows(KICK_VIEWER_DEBUG_PATH))
-
-    def handle_kick_viewer_debug_post(self):
-        self.handle_debug_append(KICK_VIEWER_DEBUG_PATH)
+        runtime, version, _ = set_state_topic("runtime", payload)
+        self.send_json({"status": "ok", "runtime": runtime, "version": version})
 
     def handle_train_status_get(self):
-        self.send_json(load_train_status())
+        self.send_state_topic("train")
 
     def handle_train_status_post(self):
         content_length = int(self.headers.get("Content-Length", "0"))
@@ -488,9 +1012,16 @@ class OverlayHandler(SimpleHTTPRequestHandler):
             self.send_json({"error": "Invalid train status payload"}, status=HTTPStatus.BAD_REQUEST)
             return
 
-        status = sanitize_train_status(payload)
-        save_train_status(status)
-        self.send_json({"status": "ok", "train": status})
+        status, version, _ = set_state_topic("train", payload)
+        self.send_json({"status": "ok", "train": status, "version": version})
+
+    def send_state_topic(self, topic: str):
+        value, version = get_state_topic(topic)
+        etag = self.encoded_etag(build_etag(topic, version))
+        if self.etag_matches(etag):
+            self.send_not_modified(etag)
+            return
+        self.send_json(value, etag=etag)
 
     def handle_twitch_avatar_get(self, parsed):
         params = parse_qs(parsed.query or "")
@@ -518,16 +1049,220 @@ class OverlayHandler(SimpleHTTPRequestHandler):
         persist_twitch_avatar(login, image_url, user_id=user_id, message_id=message_id)
         self.send_json({"status": "ok", "login": login, "avatarUrl": image_url})
 
-    def send_json(self, payload, status=HTTPStatus.OK):
-        body = json.dumps(payload, ensure_ascii=True).encode("utf-8")
+    def handle_twitch_avatars_get(self, parsed):
+        params = parse_qs(parsed.query or "")
+        logins = []
+        for value in params.get("logins", []):
+            for login in value.split(","):
+                login = login.strip().lower()
+                if login and login not in logins:
+                    logins.append(login)
+        if not logins:
+            self.send_json({"error": "Missing logins"}, status=HTTPStatus.BAD_REQUEST)
+            return
+        if len(logins) > TWITCH_AVATARS_REQUEST_MAX_LOGINS:
+            self.send_json(
+                {"error": f"At most {TWITCH_AVATARS_REQUEST_MAX_LOGINS} logins per request"},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+            return
+
+        results = fetch_twitch_avatar_urls(logins)
+        if any(error_code == "missing_credentials" for _, error_code in results.values()):
+            self.send_json(
+                {"error": "Set CHATBOX_TWITCH_CLIENT_ID and CHATBOX_TWITCH_ACCESS_TOKEN to enable Twitch avatar fetching."},
+                status=HTTPStatus.SERVICE_UNAVAILABLE,
+            )
+            return
+
+        avatars = {}
+        missing = []
+        failed = []
+        for login in logins:
+            avatar_url, error_code = results[login]
+            if error_code is None:
+                avatars[login] = avatar_url
+            elif error_code == "not_found":
+                missing.append(login)
+            else:
+                failed.append(login)
+        persist_twitch_avatars(avatars)
+        self.send_json({"status": "ok", "avatars": avatars, "missing": missing, "failed": failed})
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        try:
+            stat = os.stat(path)
+            entry = load_static_entry(path, stat)
+        except OSError:
+            return super().send_head()
+
+        content_type = self.guess_type(path)
+        compressible = content_type in COMPRESSIBLE_CONTENT_TYPES and stat.st_size >= STATIC_COMPRESSION_MIN_BYTES
+        encoding = self.negotiate_encoding() if compressible and entry["body"] is not None else ""
+        etag = entry["etag"] if not encoding else f'{entry["etag"][:-1]}-{encoding}"'
+        last_modified = self.date_time_string(stat.st_mtime)
+
+        if self.etag_matches(etag) or self.not_modified_since(stat.st_mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Cache-Control", "no-cache")
+            if compressible:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        if entry["body"] is None:
+            body_file = open(path, "rb")
+            content_length = stat.st_size
+        else:
+            body = load_static_body(path, entry, encoding)
+            body_file = BytesIO(body)
+            content_length = len(body)
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(content_length))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        return body_file
+
+    def not_modified_since(self, mtime: float) -> bool:
+        if "If-None-Match" in self.headers:
+            return False
+        header = self.headers.get("If-Modified-Since", "")
+        if not header:
+            return False
+        try:
+            since = parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(mtime) <= since.timestamp()
+
+    def negotiate_encoding(self) -> str:
+        accepted = set()
+        for item in self.headers.get("Accept-Encoding", "").split(","):
+            name, _, params = item.strip().partition(";")
+            quality = params.strip().removeprefix("q=")
+            try:
+                if params and float(quality) <= 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(name.strip().lower())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return ""
+
+    def send_json(self, payload, status=HTTPStatus.OK, etag=None):
+        body = encode_json(payload)
+        encoding = self.negotiate_encoding() if len(body) >= JSON_COMPRESSION_MIN_BYTES else ""
+        if encoding:
+            body = compress_body(body, encoding, static=False)
         self.send_response(status)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(body)))
-        self.send_header("Cache-Control", "no-store")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        else:
+            self.send_header("Cache-Control", "no-store")
         self.end_headers()
         self.wfile.write(body)
 
-    def handle_debug_append(self, path: Path):
+    def send_json_fragments(self, fragments: list[bytes], status=HTTPStatus.OK, etag=None):
+        size = sum(len(fragment) for fragment in fragments)
+        encoding = self.negotiate_encoding() if size >= JSON_COMPRESSION_MIN_BYTES else ""
+        if encoding:
+            fragments = compress_fragments(fragments, encoding)
+            size = sum(len(fragment) for fragment in fragments)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(size))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        else:
+            self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        for chunk in chunk_fragments(fragments):
+            self.wfile.write(chunk)
+
+    def etag_matches(self, etag: str) -> bool:
+        header = self.headers.get("If-None-Match", "")
+        if not header:
+            return False
+        candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+        return "*" in candidates or etag in candidates
+
+    def encoded_etag(self, etag: str) -> str:
+        encoding = self.negotiate_encoding()
+        return etag if not encoding else f'{etag[:-1]}-{encoding}"'
+
+    def send_not_modified(self, etag: str):
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+
+    def handle_debug_get(self, channel: str, parsed):
+        params = parse_qs(parsed.query)
+        if not params:
+            self.send_json(load_debug_rows(DEBUG_LOG_CHANNELS[channel]))
+            return
+
+        try:
+            query, values = build_debug_query(channel, params)
+        except ValueError as error:
+            self.send_json({"error": str(error)}, status=HTTPStatus.BAD_REQUEST)
+            return
+
+        flush_debug_log(DEBUG_LOG_CHANNELS[channel])
+        connection = open_debug_store_connection()
+        try:
+            rows = connection.execute(query, values)
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            while True:
+                batch = rows.fetchmany(DEBUG_QUERY_CHUNK_ROWS)
+                if not batch:
+                    break
+                chunk = "".join(
+                    f'{{"id": {row[0]}, "loggedAt": {row[1]}, "event": {row[2]}}}\n' for row in batch
+                ).encode("utf-8")
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                self._metrics_bytes += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            connection.close()
+
+    def handle_debug_append(self, channel: str):
         content_length = int(self.headers.get("Content-Length", "0"))
         raw_body = self.rfile.read(content_length) if content_length > 0 else b""
 
@@ -542,19 +1277,89 @@ class OverlayHandler(SimpleHTTPRequestHandler):
             return
 
         payload["loggedAt"] = int(datetime.now(timezone.utc).timestamp() * 1000)
-        path.parent.mkdir(parents=True, exist_ok=True)
         try:
-            with path.open("a", encoding="utf-8") as handle:
-                handle.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            queued = append_debug_row(channel, payload)
         except OSError:
             self.send_json({"error": "Could not write debug log"}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
             return
+        if not queued:
+            self.send_json({"error": "Debug log queue is full"}, status=HTTPStatus.SERVICE_UNAVAILABLE)
+            return
 
         self.send_json({"status": "ok"})
 
+    def handle_metrics_get(self, parsed):
+        if first_query_value(parse_qs(parsed.query), "format") == "json":
+            self.send_json(build_metrics_json())
+            return
+
+        body = format_prometheus_metrics().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request_ring_get(self, parsed):
+        params = parse_qs(parsed.query)
+        limit = parse_query_int(params, "limit", REQUEST_RING.maxlen)
+        min_status = parse_query_int(params, "minStatus", 0)
+        route = first_query_value(params, "route")
+        requests = [
+            entry
+            for entry in list(REQUEST_RING)
+            if entry["status"] >= min_status and (not route or entry["route"] == route)
+        ]
+        self.send_json({"capacity": REQUEST_RING.maxlen, "requests": requests[-limit:] if limit else []})
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+    def log_error(self, fmt, *args):
+        level = "debug" if fmt == "code %d, message %s" else "error"
+        write_log(level, f"{self.address_string()} - {fmt % args}")
+
     def log_message(self, fmt, *args):
-        timestamp = datetime.now(timezone.utc).astimezone().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] {self.address_string()} - {fmt % args}")
+        write_log("info", f"{self.address_string()} - {fmt % args}")
+
+
+class AsyncResponseFile:
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        self.writer = writer
+        self.loop = loop
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= ASYNC_RESPONSE_FLUSH_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        asyncio.run_coroutine_threadsafe(self.send(data), self.loop).result()
+
+    async def send(self, data: bytes) -> None:
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+class BufferedOverlayHandler(OverlayHandler):
+    def __init__(self, raw_request: bytes, client_address, response_file: AsyncResponseFile):
+        self.raw_request = raw_request
+        self.response_file = response_file
+        super().__init__(None, client_address, None)
+
+    def setup(self):
+        self.rfile = BytesIO(self.raw_request)
+        self.wfile = self.response_file
+
+    def finish(self):
+        self.wfile.flush()
 
 
 def is_valid_message(payload: object) -> bool:
@@ -565,7 +1370,8 @@ def is_valid_message(payload: object) -> bool:
         if not isinstance(payload.get(key), str) or not payload.get(key):
             return False
 
-    if not isinstance(payload.get("timestamp"), int):
+    timestamp = payload.get("timestamp")
+    if not isinstance(timestamp, int) or isinstance(timestamp, bool) or not SQLITE_INT_MIN <= timestamp <= SQLITE_INT_MAX:
         return False
 
     variant = payload.get("variant", "chat")
@@ -580,7 +1386,7 @@ def is_valid_message(payload: object) -> bool:
     if not isinstance(content_parts, list):
         return False
     for part in content_parts:
-        if not isinstance(part, dict):
+        if not isinstance(part, dict) or not is_storable_json_value(part):
             return False
         if not isinstance(part.get("type"), str):
             return False
@@ -589,13 +1395,37 @@ def is_valid_message(payload: object) -> bool:
         if part.get("type") == "emote" and not isinstance(part.get("imageUrl", ""), str):
             return False
 
-    for key in ("giftId", "giftName", "giftImageUrl"):
+    for key in ("avatarUrl", "amountText", "tone", "memberLabel", "giftId", "giftName", "giftImageUrl"):
         if key in payload and not isinstance(payload.get(key), str):
             return False
 
+    if payload.get("color") is not None and not isinstance(payload.get("color"), str):
+        return False
+
+    for key in ("messageId", "userId"):
+        value = payload.get(key)
+        if isinstance(value, int) and not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+            return False
+        if value is not None and not isinstance(value, (str, int, float)):
+            return False
+
     return True
 
 
+def is_storable_json_value(value: object) -> bool:
+    if value is None or isinstance(value, (str, bool)):
+        return True
+    if isinstance(value, int):
+        return SQLITE_INT_MIN <= value <= SQLITE_INT_MAX
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, list):
+        return all(is_storable_json_value(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and is_storable_json_value(item) for key, item in value.items())
+    return False
+
+
 def is_remove_request(payload: object) -> bool:
     if not isinstance(payload, dict):
         return False
@@ -609,7 +1439,129 @@ def first_query_value(query: dict, key: str) -> str:
     return str(values[0] or "").strip()
 
 
-def is_duplicate_message(connection: sqlite3.Connection, payload: dict) -> bool:
+def parse_query_int(query: dict, key: str, fallback: int = 0) -> int:
+    try:
+        return max(0, int(first_query_value(query, key) or fallback))
+    except ValueError:
+        return fallback
+
+
+def load_history_version(connection: sqlite3.Connection) -> tuple[int, int]:
+    row = connection.execute(
+        """
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM messages),
+               (SELECT COALESCE(MAX(id), 0) FROM removed_messages)
+        """
+    ).fetchone()
+    return row[0], row[1]
+
+
+def load_history_page(
+    connection: sqlite3.Connection,
+    since: int | None = None,
+    removed_since: int | None = None,
+    limit: int = 0,
+    tail: int = 0,
+    encode_messages: bool = False,
+) -> dict:
+    cursor = connection.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+    removed_cursor = connection.execute("SELECT COALESCE(MAX(id), 0) FROM removed_messages").fetchone()[0]
+
+    cursor_invalid = since is not None and since > cursor
+    removed_cursor_invalid = removed_since is not None and removed_since > removed_cursor
+    if cursor_invalid or removed_cursor_invalid:
+        return {
+            "messages": [],
+            "removals": [],
+            "cursor": cursor,
+            "removedCursor": removed_cursor,
+            "hasMore": False,
+            "reset": True,
+        }
+
+    has_more = False
+    if since is None:
+        query = (
+            f"SELECT {HISTORY_SELECT_COLUMNS} FROM {HISTORY_SELECT_FROM} "
+            "WHERE m.id <= ? ORDER BY m.timestamp_ms DESC, m.id DESC"
+        )
+        params = [cursor]
+        if tail or limit:
+            query += " LIMIT ?"
+            params.append(tail or limit)
+        rows = connection.execute(query, params).fetchall()
+        rows.reverse()
+    else:
+        query = f"SELECT {HISTORY_SELECT_COLUMNS} FROM {HISTORY_SELECT_FROM} WHERE m.id > ? AND m.id <= ? ORDER BY m.id ASC"
+        params = [since, cursor]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = connection.execute(query, params).fetchall()
+        if limit and len(rows) == limit and rows[-1]["id"] < cursor:
+            has_more = True
+            cursor = rows[-1]["id"]
+
+    removals = []
+    if removed_since is not None and removed_since < removed_cursor:
+        removals = [
+            {"platform": row["platform"], "messageId": row["message_id"]}
+            for row in connection.execute(
+                """
+                SELECT platform, message_id
+                FROM removed_messages
+                WHERE id > ?
+                  AND id <= ?
+                ORDER BY id ASC
+                """,
+                (removed_since, removed_cursor),
+            ).fetchall()
+        ]
+
+    return {
+        "messages": encode_message_rows(rows) if encode_messages else [row_to_message(row) for row in rows],
+        "removals": removals,
+        "cursor": cursor,
+        "removedCursor": removed_cursor,
+        "hasMore": has_more,
+        "reset": False,
+    }
+
+
+def build_dedupe_key(
+    platform: str,
+    variant: str,
+    username: str,
+    text: str,
+    amount_text: str | None,
+    tone: str | None,
+    bucket: int,
+) -> int:
+    raw = "\x1f".join(
+        str(value or "")
+        for value in (platform, variant, username, text, amount_text, tone, bucket)
+    )
+    digest = hashlib.blake2b(raw.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def payload_dedupe_keys(payload: dict) -> list[int]:
+    bucket = int(payload["timestamp"]) // DEDUPE_WINDOW_MS
+    return [
+        build_dedupe_key(
+            payload["platform"],
+            payload.get("variant", "chat"),
+            payload["username"],
+            payload["text"],
+            payload.get("amountText", ""),
+            payload.get("tone", ""),
+            bucket + offset,
+        )
+        for offset in (0, -1, 1)
+    ]
+
+
+def is_duplicate_message(connection: sqlite3.Connection, payload: dict, dedupe_keys: list[int] | None = None) -> bool:
     message_id = str(payload.get("messageId", "") or "").strip()
     if message_id:
         removed_row = connection.execute(
@@ -618,7 +1570,6 @@ def is_duplicate_message(connection: sqlite3.Connection, payload: dict) -> bool:
             FROM removed_messages
             WHERE platform = ?
               AND message_id = ?
-            ORDER BY id DESC
             LIMIT 1
             """,
             (payload["platform"], message_id),
@@ -626,160 +1577,1333 @@ def is_duplicate_message(connection: sqlite3.Connection, payload: dict) -> bool:
         if removed_row is not None:
             return True
 
-        row = connection.execute(
-            """
-            SELECT id
-            FROM messages
-            WHERE platform = ?
-              AND message_id = ?
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (payload["platform"], message_id),
-        ).fetchone()
-        if row is not None:
-            return True
-
+    if dedupe_keys is None:
+        dedupe_keys = payload_dedupe_keys(payload)
     row = connection.execute(
         """
         SELECT id
         FROM messages
-        WHERE platform = ?
-          AND variant = ?
-          AND username = ?
-          AND text = ?
-          AND COALESCE(amount_text, '') = ?
-          AND COALESCE(tone, '') = ?
-          AND ABS(timestamp_ms - ?) <= 1000
-        ORDER BY id DESC
+        WHERE dedupe_key IN (?, ?, ?)
+          AND ABS(timestamp_ms - ?) <= ?
         LIMIT 1
         """,
+        (*dedupe_keys, int(payload["timestamp"]), DEDUPE_WINDOW_MS),
+    ).fetchone()
+    return row is not None
+
+
+def insert_history_message(connection: sqlite3.Connection, payload: dict) -> int | None:
+    dedupe_keys = payload_dedupe_keys(payload)
+    if is_duplicate_message(connection, payload, dedupe_keys):
+        return None
+
+    user_ref = upsert_user(connection, payload["platform"], payload.get("userId"), payload["username"], payload.get("avatarUrl"))
+    gift_image_url = payload.get("giftImageUrl", "")
+    gift_image_ref = intern_value(connection, "image_urls", gift_image_url) if gift_image_url else None
+    cursor = connection.execute(
+        """
+        INSERT OR IGNORE INTO messages (
+            platform, variant, username, text, color, avatar_url, is_broadcaster,
+            timestamp_ms, badges_json, amount_text, tone, member_label, message_id, user_id,
+            gift_id, gift_name, gift_image_url, gift_image_ref, content_parts_json, dedupe_key, user_ref
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
         (
             payload["platform"],
             payload.get("variant", "chat"),
             payload["username"],
             payload["text"],
+            payload.get("color"),
+            payload.get("avatarUrl", ""),
+            1 if payload.get("isBroadcaster") else 0,
+            int(payload["timestamp"]),
+            encode_badges(connection, payload.get("badges", [])),
             payload.get("amountText", ""),
             payload.get("tone", ""),
-            int(payload["timestamp"]),
+            payload.get("memberLabel", ""),
+            str(payload.get("messageId", "") or "").strip(),
+            payload.get("userId", ""),
+            payload.get("giftId", ""),
+            payload.get("giftName", ""),
+            "",
+            gift_image_ref,
+            encode_content_parts(connection, payload.get("contentParts", [])),
+            dedupe_keys[0],
+            user_ref,
         ),
-    ).fetchone()
-    return row is not None
+    )
+    if cursor.rowcount == 0:
+        return None
+    return cursor.lastrowid
+
+
+def insert_history_batch(items: list) -> tuple[list[str], list[dict]]:
+    results = []
+    inserted = []
+    with DB_LOCK, db_connection() as connection:
+        if not connection.in_transaction:
+            connection.execute("BEGIN")
+        for item in items:
+            if not is_valid_message(item):
+                results.append("invalid")
+                continue
+            connection.execute("SAVEPOINT batch_item")
+            try:
+                row_id = insert_history_message(connection, item)
+            except (sqlite3.Error, OverflowError, TypeError, ValueError) as error:
+                connection.execute("ROLLBACK TO batch_item")
+                connection.execute("RELEASE batch_item")
+                forget_interned_values()
+                write_log("warning", f"History batch skipped a message that could not be stored: {error}")
+                results.append("invalid")
+                continue
+            connection.execute("RELEASE batch_item")
+            if row_id is None:
+                results.append("duplicate")
+                continue
+            results.append("ok")
+            inserted.append(item)
+        connection.commit()
+    return results, inserted
+
+
+def start_history_writer() -> None:
+    global HISTORY_WRITE_QUEUE, HISTORY_WRITER_THREAD
+    HISTORY_WRITE_QUEUE = Queue(maxsize=max(1, env_int("CHATBOX_HISTORY_QUEUE_SIZE", 5000)))
+    HISTORY_WRITER_THREAD = Thread(
+        target=run_history_writer,
+        args=(
+            HISTORY_WRITE_QUEUE,
+            max(1, env_int("CHATBOX_HISTORY_COMMIT_INTERVAL_MS", 50)) / 1000,
+            max(1, env_int("CHATBOX_HISTORY_COMMIT_ROWS", 200)),
+        ),
+        name="history-writer",
+        daemon=True,
+    )
+    HISTORY_WRITER_THREAD.start()
+
+
+def stop_history_writer() -> None:
+    global HISTORY_WRITE_QUEUE, HISTORY_WRITER_THREAD
+    if HISTORY_WRITE_QUEUE is None:
+        return
+    queue = HISTORY_WRITE_QUEUE
+    HISTORY_WRITE_QUEUE = None
+    queue.put(None)
+    HISTORY_WRITER_THREAD.join()
+    HISTORY_WRITER_THREAD = None
+
+
+def enqueue_history_write(payload: dict) -> int | None:
+    queue = HISTORY_WRITE_QUEUE
+    if queue is None:
+        return None
+    with HISTORY_WRITE_SEQUENCE_LOCK:
+        sequence = next(HISTORY_WRITE_SEQUENCE)
+    try:
+        queue.put(payload, timeout=HISTORY_WRITE_QUEUE_TIMEOUT_SEC)
+    except Full:
+        return None
+    return sequence
+
+
+def run_history_writer(queue: Queue, commit_interval_sec: float, commit_rows: int) -> None:
+    stopping = False
+    while not stopping:
+        first = queue.get()
+        if first is None:
+            break
+
+        pending = [first]
+        deadline = time.monotonic() + commit_interval_sec
+        while len(pending) < commit_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = queue.get(timeout=remaining)
+            except Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            pending.append(item)
+
+        if stopping:
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    break
+                if item is not None:
+                    pending.append(item)
+
+        try:
+            _, inserted = insert_history_batch(pending)
+        except Exception as error:
+            write_log("error", f"History write-behind commit failed for {len(pending)} messages, retrying each: {error}")
+            inserted = []
+            for item in pending:
+                try:
+                    inserted.extend(insert_history_batch([item])[1])
+                except Exception as item_error:
+                    write_log("error", f"History write-behind dropped a message: {item_error}")
+
+        if len(inserted) == 1:
+            broadcast_history_event({"type": "message", "message": inserted[0]})
+        elif inserted:
+            broadcast_history_event({"type": "batch", "messages": inserted})
+
+
+def encode_json(payload) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass
+    return json.dumps(payload, ensure_ascii=True).encode("utf-8")
+
+
+def configure_message_json_cache() -> None:
+    global MESSAGE_JSON_CACHE_MAX_ENTRIES
+    max_rows_per_platform = env_int("CHATBOX_HISTORY_MAX_ROWS_PER_PLATFORM", HISTORY_MAX_ROWS_PER_PLATFORM)
+    if max_rows_per_platform > 0:
+        MESSAGE_JSON_CACHE_MAX_ENTRIES = max_rows_per_platform * len(HISTORY_PLATFORMS)
+
+
+def encode_message_rows(rows: list) -> list[bytes]:
+    fragments = []
+    misses = []
+    with MESSAGE_JSON_LOCK:
+        for row in rows:
+            cached = MESSAGE_JSON_CACHE.get(row["id"])
+            if cached is not None and cached[0] == row["avatar_url"]:
+                MESSAGE_JSON_CACHE.move_to_end(row["id"])
+                fragments.append(cached[1])
+            else:
+                fragments.append(None)
+                misses.append(len(fragments) - 1)
+
+    record_cache_lookups("message_json", len(rows) - len(misses), len(misses))
+    if misses:
+        encoded = []
+        for index in misses:
+            row = rows[index]
+            fragments[index] = encode_json(row_to_message(row))
+            encoded.append((row["id"], row["avatar_url"], fragments[index]))
+        with MESSAGE_JSON_LOCK:
+            for message_id, avatar_url, fragment in encoded:
+                MESSAGE_JSON_CACHE[message_id] = (avatar_url, fragment)
+                MESSAGE_JSON_CACHE.move_to_end(message_id)
+            while len(MESSAGE_JSON_CACHE) > MESSAGE_JSON_CACHE_MAX_ENTRIES:
+                MESSAGE_JSON_CACHE.popitem(last=False)
+    return fragments
+
+
+def join_json_fragments(fragments: list[bytes]) -> list[bytes]:
+    joined = []
+    for fragment in fragments:
+        if joined:
+            joined.append(b",")
+        joined.append(fragment)
+    return joined
+
+
+def chunk_fragments(fragments: list[bytes]):
+    chunk = []
+    size = 0
+    for fragment in fragments:
+        chunk.append(fragment)
+        size += len(fragment)
+        if size >= JSON_STREAM_CHUNK_BYTES:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def compress_fragments(fragments: list[bytes], encoding: str) -> list[bytes]:
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        compressed = [compressor.process(chunk) for chunk in chunk_fragments(fragments)]
+        compressed.append(compressor.finish())
+    else:
+        compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+        compressed = [compressor.compress(chunk) for chunk in chunk_fragments(fragments)]
+        compressed.append(compressor.flush())
+    return [chunk for chunk in compressed if chunk]
+
+
+def compress_body(body: bytes, encoding: str, static: bool) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 5)
+    return gzip.compress(body, compresslevel=9 if static else 5, mtime=0)
+
+
+def load_static_entry(path: str, stat: os.stat_result) -> dict:
+    global STATIC_CACHE_BYTES
+    with STATIC_CACHE_LOCK:
+        entry = STATIC_CACHE.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            STATIC_CACHE.move_to_end(path)
+            record_cache_lookups("static", 1, 0)
+            return entry
+
+    record_cache_lookups("static", 0, 1)
+
+    if stat.st_size > STATIC_CACHE_MAX_FILE_BYTES:
+        return {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            "body": None,
+            "encoded": {},
+        }
+
+    with open(path, "rb") as handle:
+        body = handle.read()
+    entry = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "etag": f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+        "body": body,
+        "encoded": {},
+    }
+    with STATIC_CACHE_LOCK:
+        previous = STATIC_CACHE.pop(path, None)
+        if previous is not None:
+            STATIC_CACHE_BYTES -= static_entry_bytes(previous)
+        STATIC_CACHE[path] = entry
+        STATIC_CACHE_BYTES += static_entry_bytes(entry)
+        trim_static_cache()
+    return entry
+
+
+def load_static_body(path: str, entry: dict, encoding: str) -> bytes:
+    global STATIC_CACHE_BYTES
+    if not encoding:
+        return entry["body"]
+    encoded = entry["encoded"].get(encoding)
+    if encoded is not None:
+        return encoded
+
+    encoded = compress_body(entry["body"], encoding, static=True)
+    with STATIC_CACHE_LOCK:
+        if encoding not in entry["encoded"]:
+            entry["encoded"][encoding] = encoded
+            if STATIC_CACHE.get(path) is entry:
+                STATIC_CACHE_BYTES += len(encoded)
+                trim_static_cache()
+    return encoded
+
+
+def static_entry_bytes(entry: dict) -> int:
+    return len(entry["body"] or b"") + sum(len(value) for value in entry["encoded"].values())
+
+
+def trim_static_cache() -> None:
+    global STATIC_CACHE_BYTES
+    while STATIC_CACHE_BYTES > STATIC_CACHE_MAX_BYTES and len(STATIC_CACHE) > 1:
+        _, evicted = STATIC_CACHE.popitem(last=False)
+        STATIC_CACHE_BYTES -= static_entry_bytes(evicted)
+
+
+def install_lock_metrics() -> None:
+    global DB_LOCK, STREAM_LOCK, STREAM_CONDITION
+    if isinstance(DB_LOCK, MeasuredLock):
+        return
+    DB_LOCK = MeasuredLock("db", DB_LOCK)
+    STREAM_LOCK = MeasuredLock("stream", STREAM_LOCK)
+    STREAM_CONDITION = Condition(STREAM_LOCK)
+
+
+def increment_metric(name: str, labels: tuple = (), amount: float = 1) -> None:
+    key = (name, labels)
+    with METRICS_LOCK:
+        METRICS_COUNTERS[key] = METRICS_COUNTERS.get(key, 0) + amount
+
+
+def observe_metric(name: str, labels: tuple, value: float) -> None:
+    index = bisect_left(METRICS_BUCKETS_SEC, value)
+    key = (name, labels)
+    with METRICS_LOCK:
+        histogram = METRICS_HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = METRICS_HISTOGRAMS[key] = [[0] * (len(METRICS_BUCKETS_SEC) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def record_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    with METRICS_LOCK:
+        for result, amount in (("hit", hits), ("miss", misses)):
+            if amount:
+                key = ("chatbox_cache_requests_total", (("cache", cache), ("result", result)))
+                METRICS_COUNTERS[key] = METRICS_COUNTERS.get(key, 0) + amount
+
+
+def metrics_route(path: str) -> str:
+    path = path.partition("?")[0]
+    if path in METRICS_ROUTES:
+        return path
+    if path.startswith("/api/debug/") and path[11:] in DEBUG_LOG_CHANNELS:
+        return path
+    if path.startswith("/api/"):
+        return "/api/other"
+    return "static"
+
+
+def record_request(
+    method: str | None,
+    path: str,
+    status: int,
+    elapsed_sec: float,
+    body_bytes: int,
+    client: str,
+) -> None:
+    route = metrics_route(path)
+    method = method if method in METRICS_METHODS else "other"
+    record_request_metrics(method, route, status, elapsed_sec, body_bytes)
+    log_request_access(method, path, route, int(status), elapsed_sec, body_bytes, client)
+
+
+def record_request_metrics(method: str, route: str, status: int, elapsed_sec: float, body_bytes: int) -> None:
+    increment_metric("chatbox_http_requests_total", (("method", method), ("route", route), ("status", str(int(status)))))
+    if body_bytes:
+        increment_metric("chatbox_http_response_bytes_total", (("route", route),), body_bytes)
+    if route != "/api/history/stream":
+        observe_metric("chatbox_http_request_seconds", (("method", method), ("route", route)), elapsed_sec)
+
+
+def sqlite_statement_labels(sql: str) -> tuple:
+    labels = METRICS_SQL_LABELS.get(sql)
+    if labels is not None:
+        return labels
+
+    words = sql.split(None, 1)
+    operation = words[0].lower() if words else "empty"
+    match = METRICS_SQL_TABLE_PATTERN.search(sql)
+    labels = (("statement", f"{operation} {match.group(1)}" if match else operation),)
+    if len(METRICS_SQL_LABELS) < METRICS_SQL_LABEL_LIMIT:
+        METRICS_SQL_LABELS[sql] = labels
+    return labels
+
+
+def collect_metric_gauges(counters: dict) -> list[tuple[str, tuple, float]]:
+    with STREAM_CONDITION:
+        sequence = STREAM_SEQUENCE
+        cursors = [(id(token), cursor) for token, cursor in STREAM_SUBSCRIBERS.items()]
+        buffered = len(STREAM_EVENTS)
+
+    gauges = [
+        ("chatbox_uptime_seconds", (), round(time.monotonic() - METRICS_STARTED_AT, 3)),
+        ("chatbox_stream_subscribers", (), len(cursors)),
+        ("chatbox_stream_buffered_events", (), buffered),
+        ("chatbox_db_pool_idle_connections", (), DB_POOL.qsize()),
+    ]
+    for ident, cursor in cursors:
+        gauges.append(("chatbox_stream_subscriber_backlog_events", (("subscriber", f"{ident:x}"),), sequence - cursor))
+    for queue_name, queue in (("history_write", HISTORY_WRITE_QUEUE), ("debug_log", DEBUG_LOG_QUEUE)):
+        if queue is not None:
+            gauges.append(("chatbox_queue_depth", (("queue", queue_name),), queue.qsize()))
+
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == "chatbox_cache_requests_total":
+            totals = lookups.setdefault(labels[0], [0, 0])
+            totals[0 if labels[1][1] == "hit" else 1] += value
+    for labels, (hits, misses) in sorted(lookups.items()):
+        gauges.append(("chatbox_cache_hit_ratio", (labels,), round(hits / (hits + misses), 4)))
+    return gauges
+
+
+def snapshot_metrics() -> tuple[dict, dict, list]:
+    with METRICS_LOCK:
+        counters = dict(METRICS_COUNTERS)
+        histograms = {key: (list(counts), total, count) for key, (counts, total, count) in METRICS_HISTOGRAMS.items()}
+    return counters, histograms, collect_metric_gauges(counters)
+
+
+def format_metric_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_prometheus_metrics() -> str:
+    counters, histograms, gauges = snapshot_metrics()
+    samples = {}
+    for (name, labels), value in sorted(counters.items()):
+        samples.setdefault(name, []).append(f"{name}{format_metric_labels(labels)} {value}")
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket in zip((*METRICS_BUCKETS_SEC, "+Inf"), counts):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{format_metric_labels((*labels, ('le', bound)))} {cumulative}")
+        lines.append(f"{name}_sum{format_metric_labels(labels)} {total:.6f}")
+        lines.append(f"{name}_count{format_metric_labels(labels)} {count}")
+    for name, labels, value in gauges:
+        samples.setdefault(name, []).append(f"{name}{format_metric_labels(labels)} {value}")
+
+    output = []
+    for name in sorted(samples):
+        metric_type, description = METRICS_DESCRIPTIONS[name]
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(samples[name])
+    return "\n".join(output) + "\n"
+
+
+def estimate_metric_quantile(counts: list[int], count: int, quantile: float) -> float:
+    if not count:
+        return 0.0
+    rank = quantile * count
+    cumulative = 0
+    lower = 0.0
+    for bound, bucket in zip(METRICS_BUCKETS_SEC, counts):
+        if bucket and cumulative + bucket >= rank:
+            return round(lower + (bound - lower) * (rank - cumulative) / bucket, 6)
+        cumulative += bucket
+        lower = bound
+    return METRICS_BUCKETS_SEC[-1]
+
+
+def build_metrics_json() -> dict:
+    counters, histograms, gauges = snapshot_metrics()
+    return {
+        "counters": [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(counters.items())
+        ],
+        "histograms": [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "count": count,
+                "sumSec": round(total, 6),
+                "p50Sec": estimate_metric_quantile(counts, count, 0.5),
+                "p95Sec": estimate_metric_quantile(counts, count, 0.95),
+                "p99Sec": estimate_metric_quantile(counts, count, 0.99),
+            }
+            for (name, labels), (counts, total, count) in sorted(histograms.items())
+        ],
+        "gauges": [{"name": name, "labels": dict(labels), "value": value} for name, labels, value in gauges],
+    }
+
+
+def get_store_version(store: str) -> int:
+    with STORE_VERSION_LOCK:
+        return STORE_VERSIONS[store]
+
 
+def bump_store_version(store: str) -> int:
+    with STORE_VERSION_LOCK:
+        STORE_VERSIONS[store] += 1
+        return STORE_VERSIONS[store]
 
-def broadcast_history_event(payload: dict) -> None:
+
+def build_etag(*parts: object) -> str:
+    return '"' + "-".join(str(part) for part in (SERVER_BOOT_ID, *parts)) + '"'
+
+
+def broadcast_history_event(payload: dict, topic: str = "history") -> int:
+    global STREAM_SEQUENCE
     message = json.dumps(payload, ensure_ascii=True)
-    with STREAM_LOCK:
-        subscribers = list(STREAM_SUBSCRIBERS)
-    for queue in subscribers:
-        queue.put(message)
+    with STREAM_CONDITION:
+        if topic != "history" and not any(
+            topics is None or topic in topics for topics in STREAM_SUBSCRIBER_TOPICS.values()
+        ):
+            return STREAM_SEQUENCE
+        STREAM_SEQUENCE += 1
+        STREAM_EVENTS.append((STREAM_SEQUENCE, topic, message))
+        STREAM_CONDITION.notify_all()
+        sequence = STREAM_SEQUENCE
+    for listener in STREAM_LISTENERS:
+        listener()
+    return sequence
+
+
+def format_stream_event(sequence: int, message: str) -> bytes:
+    return f"id: {SERVER_BOOT_ID}-{sequence}\ndata: {message}\n\n".encode("utf-8")
+
+
+def parse_stream_topics(params: dict) -> set[str] | None:
+    if "topics" not in params:
+        return set(STREAM_DEFAULT_TOPICS)
+    return {
+        topic.strip()
+        for value in params["topics"]
+        for topic in value.split(",")
+        if topic.strip() == "history" or topic.strip() in STATE_TOPICS
+    }
 
 
-def load_debug_rows(path: Path) -> list[dict]:
-    if not path.exists():
-        return []
+def format_state_snapshot(cursor: int, topics: set[str] | None) -> bytes:
+    if topics is None:
+        return b""
+    chunks = []
+    for topic in STATE_TOPICS:
+        if topic in topics:
+            value, version = get_state_topic(topic)
+            chunks.append(format_stream_event(cursor, json.dumps({"type": topic, topic: value, "version": version})))
+    return b"".join(chunks)
 
-    rows = []
+
+def parse_stream_event_id(value: str) -> int | None:
+    boot_id, _, sequence = value.strip().rpartition("-")
+    if boot_id != SERVER_BOOT_ID:
+        return None
     try:
-        for line in path.read_text(encoding="utf-8").splitlines()[-200:]:
-            line = line.strip()
-            if not line:
-                continue
+        return int(sequence)
+    except ValueError:
+        return None
+
+
+def open_stream_cursor(token: object, last_event_id: str = "", topics: set[str] | None = None) -> tuple[int, bool]:
+    with STREAM_CONDITION:
+        cursor = STREAM_SEQUENCE
+        resync = False
+        if last_event_id:
+            requested = parse_stream_event_id(last_event_id)
+            oldest = STREAM_EVENTS[0][0] if STREAM_EVENTS else STREAM_SEQUENCE + 1
+            if requested is None or requested > STREAM_SEQUENCE or requested < oldest - 1:
+                resync = True
+            else:
+                cursor = requested
+        STREAM_SUBSCRIBERS[token] = cursor
+        STREAM_SUBSCRIBER_TOPICS[token] = topics
+        return cursor, resync
+
+
+def close_stream_cursor(token: object) -> None:
+    with STREAM_CONDITION:
+        STREAM_SUBSCRIBERS.pop(token, None)
+        STREAM_SUBSCRIBER_TOPICS.pop(token, None)
+
+
+def read_stream_events(
+    token: object,
+    cursor: int,
+    timeout: float,
+    topics: set[str] | None = None,
+) -> tuple[list[tuple[int, str]], int, bool]:
+    with STREAM_CONDITION:
+        STREAM_CONDITION.wait_for(lambda: STREAM_SEQUENCE > cursor, timeout=timeout)
+        return collect_stream_events(token, cursor, topics)
+
+
+def collect_stream_events(
+    token: object,
+    cursor: int,
+    topics: set[str] | None = None,
+) -> tuple[list[tuple[int, str]], int, bool]:
+    with STREAM_CONDITION:
+        if STREAM_SEQUENCE <= cursor:
+            return [], cursor, False
+
+        oldest = STREAM_EVENTS[0][0]
+        if cursor < oldest - 1:
+            STREAM_SUBSCRIBERS[token] = STREAM_SEQUENCE
+            return [], STREAM_SEQUENCE, True
+
+        events = [
+            (sequence, message)
+            for sequence, topic, message in itertools.islice(STREAM_EVENTS, cursor - oldest + 1, None)
+            if topics is None or topic in topics
+        ]
+        STREAM_SUBSCRIBERS[token] = STREAM_SEQUENCE
+        return events, STREAM_SEQUENCE, False
+
+
+def start_log_writer() -> None:
+    global LOG_QUEUE, LOG_THREAD, LOG_LEVEL, ACCESS_LOG_SLOW_MS, REQUEST_RING
+    LOG_LEVEL = LOG_LEVELS.get(os.environ.get("CHATBOX_LOG_LEVEL", "").strip().lower(), LOG_LEVELS["info"])
+    ACCESS_LOG_SLOW_MS = max(0, env_int("CHATBOX_ACCESS_LOG_SLOW_MS", ACCESS_LOG_SLOW_MS))
+    ACCESS_LOG_SAMPLE_RATES.update(parse_log_sample_rates(os.environ.get("CHATBOX_ACCESS_LOG_SAMPLE", "")))
+    REQUEST_RING = deque(REQUEST_RING, maxlen=max(1, env_int("CHATBOX_REQUEST_RING_SIZE", REQUEST_RING_SIZE)))
+    LOG_QUEUE = Queue(maxsize=LOG_QUEUE_SIZE)
+    LOG_THREAD = Thread(target=run_log_writer, args=(LOG_QUEUE,), name="log-writer", daemon=True)
+    LOG_THREAD.start()
+
+
+def stop_log_writer() -> None:
+    global LOG_QUEUE, LOG_THREAD
+    if LOG_QUEUE is None:
+        return
+    queue = LOG_QUEUE
+    LOG_QUEUE = None
+    queue.put(None)
+    LOG_THREAD.join()
+    LOG_THREAD = None
+
+
+def parse_log_sample_rates(value: str) -> dict:
+    rates = {}
+    for item in value.split(","):
+        target, separator, rate = item.strip().rpartition("=")
+        method, _, route = target.strip().partition(" ")
+        if not separator or not route:
+            continue
+        try:
+            rates[(method.upper(), route.strip())] = max(1, int(rate))
+        except ValueError:
+            continue
+    return rates
+
+
+def format_log_line(created_at: float, level: str, message: str) -> str:
+    timestamp = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M:%S")
+    return f"[{timestamp}] {level.upper():<7} {message}\n"
+
+
+def write_log(level: str, message: str) -> None:
+    if LOG_LEVELS[level] < LOG_LEVEL:
+        return
+    queue = LOG_QUEUE
+    if queue is None:
+        sys.stdout.write(format_log_line(time.time(), level, message))
+        return
+    try:
+        queue.put_nowait((time.time(), level, message))
+    except Full:
+        increment_metric("chatbox_log_dropped_total")
+
+
+def log_request_access(
+    method: str,
+    path: str,
+    route: str,
+    status: int,
+    elapsed_sec: float,
+    body_bytes: int,
+    client: str,
+) -> None:
+    duration_ms = round(elapsed_sec * 1000, 2)
+    if status >= 500:
+        level = "error"
+    elif status >= 400 or duration_ms >= ACCESS_LOG_SLOW_MS:
+        level = "warning"
+    else:
+        level = "info"
+    REQUEST_RING.append(
+        {
+            "at": int(time.time() * 1000),
+            "client": client,
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": status,
+            "durationMs": duration_ms,
+            "bytes": body_bytes,
+            "level": level,
+        }
+    )
+    if LOG_LEVELS[level] < LOG_LEVEL:
+        return
+
+    sampled = ""
+    rate = ACCESS_LOG_SAMPLE_RATES.get((method, route), 1) if level == "info" else 1
+    if rate > 1:
+        with ACCESS_LOG_SAMPLE_LOCK:
+            seen = ACCESS_LOG_SAMPLE_COUNTS.get((method, route), 0)
+            ACCESS_LOG_SAMPLE_COUNTS[(method, route)] = seen + 1
+        if seen % rate:
+            return
+        sampled = f" (1 in {rate})"
+    write_log(level, f'{client} - "{method} {path}" {status} {duration_ms}ms {body_bytes}B{sampled}')
+
+
+def run_log_writer(queue: Queue) -> None:
+    stopping = False
+    while not stopping:
+        entries = [queue.get()]
+        while len(entries) < LOG_BATCH_LINES:
             try:
-                rows.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
+                entries.append(queue.get_nowait())
+            except Empty:
+                break
+        if None in entries:
+            stopping = True
+            entries = [entry for entry in entries if entry is not None]
+        try:
+            sys.stdout.write("".join(format_log_line(*entry) for entry in entries))
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def start_debug_log_writer() -> None:
+    global DEBUG_LOG_QUEUE, DEBUG_LOG_THREAD
+    DEBUG_LOG_QUEUE = Queue(maxsize=DEBUG_LOG_QUEUE_SIZE)
+    DEBUG_LOG_THREAD = Thread(
+        target=run_debug_log_writer,
+        args=(
+            DEBUG_LOG_QUEUE,
+            max(64 * 1024, env_int("CHATBOX_DEBUG_LOG_MAX_BYTES", 5 * 1024 * 1024)),
+            max(0, env_int("CHATBOX_DEBUG_LOG_BACKUPS", 3)),
+            env_flag("CHATBOX_DEBUG_LOG_GZIP"),
+            max(0, env_int("CHATBOX_DEBUG_STORE_MAX_AGE_DAYS", 30)),
+        ),
+        name="debug-log-writer",
+        daemon=True,
+    )
+    DEBUG_LOG_THREAD.start()
+
+
+def stop_debug_log_writer() -> None:
+    global DEBUG_LOG_QUEUE, DEBUG_LOG_THREAD
+    if DEBUG_LOG_QUEUE is None:
+        return
+    queue = DEBUG_LOG_QUEUE
+    DEBUG_LOG_QUEUE = None
+    queue.put(None)
+    DEBUG_LOG_THREAD.join()
+    DEBUG_LOG_THREAD = None
+
+
+def append_debug_row(channel: str, payload: dict) -> bool:
+    path = DEBUG_LOG_CHANNELS[channel]
+    line = json.dumps(payload, ensure_ascii=False) + "\n"
+    logged_at = payload.get("loggedAt")
+    if not isinstance(logged_at, int):
+        logged_at = int(time.time() * 1000)
+    queue = DEBUG_LOG_QUEUE
+    if queue is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as handle:
+            handle.write(line)
+        connection = open_debug_store_connection()
+        try:
+            insert_debug_events(connection, [(channel, logged_at, line.rstrip("\n"))])
+        except sqlite3.Error as error:
+            write_log("error", f"Could not index debug event for {channel}: {error}")
+        finally:
+            connection.close()
+        return True
+    try:
+        queue.put_nowait(("row", path, line, channel, logged_at))
+    except Full:
+        return False
+    return True
+
+
+def flush_debug_log(path: Path) -> None:
+    queue = DEBUG_LOG_QUEUE
+    if queue is None:
+        return
+    done = Event()
+    try:
+        queue.put(("flush", path, done), timeout=DEBUG_LOG_FLUSH_SEC)
+    except Full:
+        return
+    done.wait(DEBUG_LOG_FLUSH_SEC)
+
+
+def run_debug_log_writer(queue: Queue, max_bytes: int, backups: int, compress: bool, max_age_days: int) -> None:
+    handles = {}
+    sizes = {}
+    pending_events = []
+    store = open_debug_store_connection()
+    next_flush = time.monotonic() + DEBUG_LOG_FLUSH_SEC
+    next_prune = time.monotonic()
+    while True:
+        try:
+            item = queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+        except Empty:
+            item = ()
+
+        if item is None:
+            break
+        if item and item[0] == "row":
+            _, path, line, channel, logged_at = item
+            pending_events.append((channel, logged_at, line.rstrip("\n")))
+            try:
+                handle = handles.get(path)
+                if handle is None:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    handle = path.open("a", encoding="utf-8", buffering=DEBUG_LOG_WRITE_BUFFER_BYTES)
+                    handles[path] = handle
+                    sizes[path] = path.stat().st_size
+                handle.write(line)
+                sizes[path] += len(line.encode("utf-8"))
+                if sizes[path] >= max_bytes:
+                    handles.pop(path).close()
+                    sizes.pop(path)
+                    rotate_debug_log(path, backups, compress)
+            except OSError as error:
+                write_log("error", f"Could not write debug log {path.name}: {error}")
+        elif item and item[0] == "flush":
+            _, path, done = item
+            handle = handles.get(path)
+            try:
+                if handle is not None:
+                    handle.flush()
+            except OSError as error:
+                write_log("error", f"Could not flush debug log {path.name}: {error}")
+            pending_events = flush_debug_events(store, pending_events)
+            done.set()
+
+        if time.monotonic() >= next_flush:
+            for path, handle in handles.items():
+                try:
+                    handle.flush()
+                except OSError as error:
+                    write_log("error", f"Could not flush debug log {path.name}: {error}")
+            pending_events = flush_debug_events(store, pending_events)
+            next_flush = time.monotonic() + DEBUG_LOG_FLUSH_SEC
+
+        if max_age_days > 0 and time.monotonic() >= next_prune:
+            cutoff = int(time.time() * 1000) - max_age_days * 24 * 60 * 60 * 1000
+            try:
+                store.execute("DELETE FROM debug_events WHERE logged_at_ms < ?", (cutoff,))
+                store.commit()
+            except sqlite3.Error as error:
+                write_log("error", f"Could not prune debug events: {error}")
+            next_prune = time.monotonic() + DEBUG_STORE_PRUNE_INTERVAL_SEC
+
+    for handle in handles.values():
+        handle.close()
+    flush_debug_events(store, pending_events)
+    store.close()
+
+
+def flush_debug_events(connection: sqlite3.Connection, events: list[tuple]) -> list[tuple]:
+    if not events:
+        return events
+    try:
+        insert_debug_events(connection, events)
+    except sqlite3.Error as error:
+        write_log("error", f"Could not index {len(events)} debug events: {error}")
+    return []
+
+
+def rotate_debug_log(path: Path, backups: int, compress: bool) -> None:
+    if backups <= 0:
+        path.unlink(missing_ok=True)
+        return
+
+    suffix = ".gz" if compress else ""
+    path.with_name(f"{path.name}.{backups}{suffix}").unlink(missing_ok=True)
+    for index in range(backups - 1, 0, -1):
+        source = path.with_name(f"{path.name}.{index}{suffix}")
+        if source.exists():
+            source.replace(path.with_name(f"{path.name}.{index + 1}{suffix}"))
+
+    if not compress:
+        path.replace(path.with_name(f"{path.name}.1"))
+        return
+    with path.open("rb") as source, gzip.open(path.with_name(f"{path.name}.1.gz"), "wb") as target:
+        shutil.copyfileobj(source, target)
+    path.unlink()
+
+
+def init_debug_store() -> None:
+    DEBUG_STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with sqlite3.connect(DEBUG_STORE_PATH) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS debug_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                logged_at_ms INTEGER NOT NULL,
+                payload_json TEXT NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_debug_events_channel_time ON debug_events(channel, logged_at_ms)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_debug_events_channel_id ON debug_events(channel, id)")
+
+
+def open_debug_store_connection() -> sqlite3.Connection:
+    connection = sqlite3.connect(DEBUG_STORE_PATH, timeout=DB_BUSY_TIMEOUT_SEC, check_same_thread=False)
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def insert_debug_events(connection: sqlite3.Connection, events: list[tuple]) -> None:
+    with connection:
+        connection.executemany(
+            "INSERT INTO debug_events (channel, logged_at_ms, payload_json) VALUES (?, ?, ?)",
+            events,
+        )
+
+
+def parse_debug_time(value: str) -> int:
+    value = value.strip()
+    if value.lstrip("-").isdigit():
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def build_debug_query(channel: str, params: dict) -> tuple[str, list]:
+    clauses = ["channel = ?"]
+    values = [channel]
+    if "from" in params:
+        clauses.append("logged_at_ms >= ?")
+        values.append(parse_debug_time(params["from"][0]))
+    if "to" in params:
+        clauses.append("logged_at_ms <= ?")
+        values.append(parse_debug_time(params["to"][0]))
+    if "cursor" in params:
+        try:
+            cursor = int(params["cursor"][0])
+        except ValueError:
+            raise ValueError("Invalid cursor") from None
+        clauses.append("id > ?")
+        values.append(cursor)
+
+    for field, field_values in params.items():
+        if field in DEBUG_QUERY_PARAMS:
+            continue
+        if not all(part.isidentifier() for part in field.split(".")):
+            raise ValueError(f"Invalid filter field: {field}")
+        value = field_values[0]
+        if value in ("true", "false"):
+            value = "1" if value == "true" else "0"
+        clauses.append("CAST(json_extract(payload_json, ?) AS TEXT) = ?")
+        values.extend((f"$.{field}", value))
+
+    try:
+        limit = int(params.get("limit", [DEBUG_QUERY_DEFAULT_LIMIT])[0])
+    except ValueError:
+        raise ValueError("Invalid limit") from None
+    values.append(max(1, min(limit, DEBUG_QUERY_MAX_LIMIT)))
+    query = f"""
+        SELECT id, logged_at_ms, payload_json
+        FROM debug_events
+        WHERE {" AND ".join(clauses)}
+        ORDER BY id ASC
+        LIMIT ?
+    """
+    return query, values
+
+
+def tail_debug_lines(path: Path, limit: int) -> list[bytes]:
+    if limit <= 0:
+        return []
+
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as handle:
+            return handle.read().splitlines()[-limit:]
+
+    with path.open("rb") as handle:
+        handle.seek(0, os.SEEK_END)
+        position = handle.tell()
+        buffer = b""
+        while position > 0 and buffer.count(b"\n") <= limit:
+            read_size = min(DEBUG_LOG_TAIL_BLOCK_BYTES, position)
+            position -= read_size
+            handle.seek(position)
+            buffer = handle.read(read_size) + buffer
+
+    lines = buffer.splitlines()
+    if position > 0:
+        lines = lines[1:]
+    return lines[-limit:]
+
+
+def load_debug_rows(path: Path, limit: int = DEBUG_LOG_TAIL_ROWS) -> list[dict]:
+    flush_debug_log(path)
+
+    lines = []
+    try:
+        if path.exists():
+            lines = tail_debug_lines(path, limit)
+        if len(lines) < limit:
+            previous_segments = [
+                candidate
+                for candidate in (path.with_name(f"{path.name}.1"), path.with_name(f"{path.name}.1.gz"))
+                if candidate.exists()
+            ]
+            if previous_segments:
+                previous = max(previous_segments, key=lambda candidate: candidate.stat().st_mtime_ns)
+                lines = tail_debug_lines(previous, limit - len(lines)) + lines
     except OSError:
         return []
 
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
     return rows
 
 
-def load_overlay_settings() -> dict:
+def read_state_export(topic: str) -> dict | None:
     try:
-        raw = SETTINGS_PATH.read_text(encoding="utf-8")
-    except FileNotFoundError:
-        return {}
+        raw = STATE_TOPICS[topic]["path"].read_text(encoding="utf-8")
     except OSError:
-        return {}
+        return None
 
     try:
         payload = json.loads(raw)
     except json.JSONDecodeError:
-        return {}
+        return None
 
     if not isinstance(payload, dict):
-        return {}
-    return sanitize_overlay_settings(payload)
+        return None
+    return sanitize_state_topic_value(topic, payload)
 
 
-def save_overlay_settings(settings: dict) -> None:
-    SETTINGS_PATH.write_text(
-        json.dumps(sanitize_overlay_settings(settings), ensure_ascii=True),
-        encoding="utf-8",
-    )
+def sanitize_state_topic_value(topic: str, payload: dict) -> dict:
+    if topic == "settings":
+        return sanitize_overlay_settings(payload)
+    if topic == "runtime":
+        return sanitize_runtime_state(payload)
+    return sanitize_train_status(payload)
 
 
-def load_runtime_state() -> dict:
+def write_export_file(path: Path, data: bytes) -> bool:
     try:
-        raw = RUNTIME_STATE_PATH.read_text(encoding="utf-8")
-    except FileNotFoundError:
-        return {}
+        if path.read_bytes() == data:
+            return False
     except OSError:
-        return {}
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.tmp")
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
+    return True
 
-    try:
-        payload = json.loads(raw)
-    except json.JSONDecodeError:
-        return {}
 
-    if not isinstance(payload, dict):
-        return {}
-    return sanitize_runtime_state(payload)
+def export_state_topic(topic: str, value: dict) -> None:
+    entry = STATE_TOPICS[topic]
+    entry["exported"] = get_store_version(topic)
+    write_export_file(entry["path"], json.dumps(value, ensure_ascii=True).encode("utf-8"))
+    if topic == "train":
+        write_export_file(TRAIN_ACTIVE_PATH, b"1" if value["active"] else b"0")
+    entry["signature"] = state_file_signature(entry["path"])
 
 
-def save_runtime_state(runtime: dict) -> None:
-    RUNTIME_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    RUNTIME_STATE_PATH.write_text(
-        json.dumps(sanitize_runtime_state(runtime), ensure_ascii=True),
-        encoding="utf-8",
-    )
+def sync_directory(path: Path) -> None:
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
 
+def write_durable_file(path: Path, data: bytes) -> None:
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with temp_path.open("wb") as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, path)
+    sync_directory(path.parent)
 
-def load_train_status() -> dict:
+
+def read_state_journal() -> tuple[dict, int]:
+    values = {}
+    try:
+        snapshot = json.loads(STATE_SNAPSHOT_PATH.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        snapshot = {}
+    topics = snapshot.get("topics") if isinstance(snapshot, dict) else None
+    for topic, value in (topics or {}).items():
+        if topic in STATE_TOPICS and isinstance(value, dict):
+            values[topic] = sanitize_state_topic_value(topic, value)
+
+    entries = 0
     try:
-        raw = TRAIN_STATUS_PATH.read_text(encoding="utf-8")
-    except FileNotFoundError:
-        return sanitize_train_status({})
+        with STATE_JOURNAL_PATH.open("rb") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                topic = record.get("topic")
+                value = record.get("value")
+                if topic in STATE_TOPICS and isinstance(value, dict):
+                    values[topic] = sanitize_state_topic_value(topic, value)
+                    entries += 1
     except OSError:
-        return sanitize_train_status({})
+        pass
+    return values, entries
+
+
+def compact_state_journal() -> None:
+    topics = {topic: entry["value"] for topic, entry in STATE_TOPICS.items() if entry["value"] is not None}
+    snapshot = {"savedAt": int(time.time() * 1000), "topics": topics}
+    write_durable_file(STATE_SNAPSHOT_PATH, json.dumps(snapshot, ensure_ascii=True).encode("utf-8"))
+    handle = STATE_JOURNAL["handle"]
+    if handle is not None:
+        handle.close()
+    handle = STATE_JOURNAL_PATH.open("ab")
+    handle.truncate(0)
+    STATE_JOURNAL["handle"] = handle
+    STATE_JOURNAL["entries"] = 0
+
+
+def append_state_journal(topic: str, value: dict) -> None:
+    record = {"topic": topic, "value": value, "savedAt": int(time.time() * 1000)}
+    handle = STATE_JOURNAL["handle"]
+    if handle is None:
+        handle = STATE_JOURNAL_PATH.open("ab")
+        STATE_JOURNAL["handle"] = handle
+    handle.write(json.dumps(record, ensure_ascii=True).encode("utf-8") + b"\n")
+    handle.flush()
+    if STATE_TOPICS[topic]["durable"]:
+        os.fsync(handle.fileno())
+    STATE_JOURNAL["entries"] += 1
+    if STATE_JOURNAL["entries"] >= STATE_JOURNAL_COMPACT_ENTRIES:
+        compact_state_journal()
+
+
+def close_state_journal() -> None:
+    with STATE_LOCK:
+        if STATE_JOURNAL["handle"] is None:
+            return
+        if STATE_JOURNAL["entries"]:
+            compact_state_journal()
+        STATE_JOURNAL["handle"].close()
+        STATE_JOURNAL["handle"] = None
 
+
+def init_state_store() -> None:
+    STATE_JOURNAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with STATE_LOCK:
+        if STATE_JOURNAL["loaded"]:
+            return
+        values, _entries = read_state_journal()
+        journal_signatures = [state_file_signature(STATE_SNAPSHOT_PATH), state_file_signature(STATE_JOURNAL_PATH)]
+        journal_mtime_ns = max((signature[0] for signature in journal_signatures if signature), default=0)
+        for topic, entry in STATE_TOPICS.items():
+            value = values.get(topic)
+            signature = state_file_signature(entry["path"])
+            if value is None or (signature is not None and signature[0] > journal_mtime_ns):
+                exported = read_state_export(topic)
+                if exported is not None:
+                    value = exported
+            if value is None:
+                value = sanitize_state_topic_value(topic, {})
+            entry["value"] = value
+            bump_store_version(topic)
+            export_state_topic(topic, value)
+        compact_state_journal()
+        STATE_JOURNAL["loaded"] = True
+
+
+def state_file_signature(path: Path) -> tuple | None:
     try:
-        payload = json.loads(raw)
-    except json.JSONDecodeError:
-        return sanitize_train_status({})
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
 
-    if not isinstance(payload, dict):
-        return sanitize_train_status({})
-    return sanitize_train_status(payload)
 
+def publish_state_topic(topic: str, value: dict, version: int) -> None:
+    broadcast_history_event({"type": topic, topic: value, "version": version}, topic=topic)
 
-def save_train_status(status: dict) -> None:
-    sanitized = sanitize_train_status(status)
-    TRAIN_STATUS_PATH.write_text(
-        json.dumps(sanitized, ensure_ascii=True),
-        encoding="utf-8",
-    )
-    TRAIN_ACTIVE_PATH.write_text("1" if sanitized["active"] else "0", encoding="utf-8")
+
+def commit_state_topic(topic: str, value: dict) -> tuple[dict, int]:
+    append_state_journal(topic, value)
+    STATE_TOPICS[topic]["value"] = value
+    version = bump_store_version(topic)
+    publish_state_topic(topic, value, version)
+    return value, version
+
+
+def state_export_pending(topic: str) -> bool:
+    return STATE_TOPICS[topic]["exported"] != get_store_version(topic)
+
+
+def get_state_topic(topic: str) -> tuple[dict, int]:
+    if not STATE_JOURNAL["loaded"]:
+        init_state_store()
+    if not STATE_WATCHER_RUNNING:
+        return refresh_state_topic(topic)
+    with STATE_LOCK:
+        return STATE_TOPICS[topic]["value"], get_store_version(topic)
+
+
+def refresh_state_topic(topic: str) -> tuple[dict, int]:
+    entry = STATE_TOPICS[topic]
+    signature = state_file_signature(entry["path"])
+    with STATE_LOCK:
+        cached = entry["value"]
+        if signature == entry["signature"]:
+            return cached, get_store_version(topic)
+        if signature is None:
+            export_state_topic(topic, cached)
+            return cached, get_store_version(topic)
+        if state_export_pending(topic):
+            write_log(
+                "warning",
+                f"{entry['path'].name} was edited before a newer {topic} change was written to it; keeping the newer change",
+            )
+            export_state_topic(topic, cached)
+            return cached, get_store_version(topic)
+        value = read_state_export(topic)
+        entry["signature"] = signature
+        if value is None or value == cached:
+            return cached, get_store_version(topic)
+        return commit_state_topic(topic, value)
+
+
+def set_state_topic(topic: str, payload: dict) -> tuple[dict, int, bool]:
+    value = sanitize_state_topic_value(topic, payload)
+    with STATE_LOCK:
+        current, version = get_state_topic(topic)
+        if value == current:
+            return current, version, False
+        value, version = commit_state_topic(topic, value)
+    return value, version, True
+
+
+def flush_state_exports() -> None:
+    with STATE_LOCK:
+        for topic, entry in STATE_TOPICS.items():
+            if state_export_pending(topic):
+                export_state_topic(topic, entry["value"])
+
+
+def run_state_watcher() -> None:
+    global STATE_WATCHER_RUNNING
+    STATE_WATCHER_RUNNING = True
+    try:
+        while not STATE_WATCH_STOP.wait(STATE_WATCH_INTERVAL_SEC):
+            for topic in STATE_TOPICS:
+                refresh_state_topic(topic)
+            flush_state_exports()
+    finally:
+        STATE_WATCHER_RUNNING = False
 
 
 def sanitize_train_status(payload: dict) -> dict:
     def safe_int(value: object, minimum: int = 0) -> int:
         try:
             numeric = int(value)
-        except (TypeError, ValueError):
+        except (TypeError, ValueError, OverflowError):
             return minimum
-        return max(minimum, numeric)
+        return max(minimum, min(SQLITE_INT_MAX, numeric))
 
     active = bool(payload.get("active"))
     status = {
@@ -821,14 +2945,16 @@ def sanitize_overlay_settings(payload: dict) -> dict:
     def safe_int(value: object, fallback: int, minimum: int, maximum: int) -> int:
         try:
             numeric = int(value)
-        except (TypeError, ValueError):
+        except (TypeError, ValueError, OverflowError):
             numeric = fallback
         return max(minimum, min(maximum, numeric))
 
     def safe_float(value: object, fallback: float, minimum: float, maximum: float) -> float:
         try:
             numeric = float(value)
-        except (TypeError, ValueError):
+        except (TypeError, ValueError, OverflowError):
+            numeric = fallback
+        if not math.isfinite(numeric):
             numeric = fallback
         return max(minimum, min(maximum, numeric))
 
@@ -856,9 +2982,9 @@ def sanitize_runtime_state(payload: dict) -> dict:
     def safe_int(value: object, fallback: int = 0, minimum: int = 0) -> int:
         try:
             numeric = int(value)
-        except (TypeError, ValueError):
+        except (TypeError, ValueError, OverflowError):
             numeric = fallback
-        return max(minimum, numeric)
+        return max(minimum, min(SQLITE_INT_MAX, numeric))
 
     result = {}
     for key, value in payload.items():
@@ -870,8 +2996,8 @@ def sanitize_runtime_state(payload: dict) -> dict:
         viewer_count = value.get("viewerCount")
         if viewer_count is not None:
             try:
-                viewer_count = max(0, int(viewer_count))
-            except (TypeError, ValueError):
+                viewer_count = max(0, min(SQLITE_INT_MAX, int(viewer_count)))
+            except (TypeError, ValueError, OverflowError):
                 viewer_count = None
         result[platform_key] = {
             "connected": bool(value.get("connected")),
@@ -888,92 +3014,562 @@ def sanitize_runtime_state(payload: dict) -> dict:
 def fetch_twitch_avatar_url(login: str):
     if not login:
         return "", "missing_login"
+    return fetch_twitch_avatar_urls([login])[login]
 
-    cached = TWITCH_AVATAR_CACHE.get(login)
-    now = time.time()
-    if cached and now - cached["timestamp"] < TWITCH_AVATAR_CACHE_TTL_SEC:
-        return cached["avatar_url"], None
 
+def fetch_twitch_avatar_urls(logins: list[str]) -> dict:
+    results = load_cached_twitch_avatars(logins)
+    flights = {}
+    leader = False
+    with TWITCH_BATCH_CONDITION:
+        for login in logins:
+            if login in results or login in flights:
+                continue
+            flight = TWITCH_AVATAR_INFLIGHT.get(login)
+            if flight is None:
+                flight = {"done": Event(), "result": ("", "twitch_lookup_failed: lookup did not finish")}
+                TWITCH_AVATAR_INFLIGHT[login] = flight
+                leader = leader or not TWITCH_BATCH_PENDING
+                TWITCH_BATCH_PENDING.append(login)
+            flights[login] = flight
+        if len(TWITCH_BATCH_PENDING) >= TWITCH_BATCH_MAX_LOGINS:
+            TWITCH_BATCH_CONDITION.notify_all()
+
+    if leader:
+        run_twitch_avatar_batches()
+
+    for login, flight in flights.items():
+        flight["done"].wait(TWITCH_LOOKUP_TIMEOUT_SEC + 1)
+        results[login] = flight["result"]
+    return results
+
+
+def run_twitch_avatar_batches() -> None:
+    deadline = time.monotonic() + TWITCH_BATCH_WINDOW_SEC
+    with TWITCH_BATCH_CONDITION:
+        while len(TWITCH_BATCH_PENDING) < TWITCH_BATCH_MAX_LOGINS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            TWITCH_BATCH_CONDITION.wait(remaining)
+        logins = TWITCH_BATCH_PENDING[:]
+        TWITCH_BATCH_PENDING.clear()
+        flights = {login: TWITCH_AVATAR_INFLIGHT[login] for login in logins}
+
+    try:
+        for offset in range(0, len(logins), TWITCH_BATCH_MAX_LOGINS):
+            batch = logins[offset:offset + TWITCH_BATCH_MAX_LOGINS]
+            batch_results = request_twitch_avatar_urls(batch)
+            store_twitch_avatars(
+                [
+                    (login, avatar_url, "found" if avatar_url else "not_found")
+                    for login, (avatar_url, error_code) in batch_results.items()
+                    if error_code is None or error_code == "not_found"
+                ]
+            )
+            for login in batch:
+                flights[login]["result"] = batch_results[login]
+    finally:
+        with TWITCH_BATCH_CONDITION:
+            for login in logins:
+                TWITCH_AVATAR_INFLIGHT.pop(login, None)
+        for flight in flights.values():
+            flight["done"].set()
+
+
+def request_twitch_avatar_urls(logins: list[str]) -> dict:
     client_id = os.environ.get("CHATBOX_TWITCH_CLIENT_ID", "").strip()
     access_token = os.environ.get("CHATBOX_TWITCH_ACCESS_TOKEN", "").strip()
     if not client_id or not access_token:
-        return "", "missing_credentials"
+        return {login: ("", "missing_credentials") for login in logins}
 
+    base_url = os.environ.get("CHATBOX_TWITCH_API_BASE_URL", "").strip() or TWITCH_API_BASE_URL
+    query = "&".join(f"login={quote(login)}" for login in logins)
     request = Request(
-        f"https://api.twitch.tv/helix/users?login={quote(login)}",
+        f"{base_url.rstrip('/')}/users?{query}",
         headers={
             "Client-Id": client_id,
             "Authorization": f"Bearer {access_token}",
         },
     )
 
+    started = time.perf_counter()
     try:
-        with urlopen(request, timeout=10) as response:
+        with urlopen(request, timeout=TWITCH_LOOKUP_TIMEOUT_SEC) as response:
             payload = json.loads(response.read().decode("utf-8"))
     except Exception as error:
-        return "", f"twitch_lookup_failed: {error}"
+        observe_metric("chatbox_twitch_lookup_seconds", (("result", "error"),), time.perf_counter() - started)
+        return {login: ("", f"twitch_lookup_failed: {error}") for login in logins}
+    observe_metric("chatbox_twitch_lookup_seconds", (("result", "ok"),), time.perf_counter() - started)
+
+    avatar_urls = {}
+    for user in payload.get("data", []):
+        if isinstance(user, dict):
+            avatar_urls[str(user.get("login") or "").lower()] = str(user.get("profile_image_url") or "").strip()
+
+    results = {}
+    for login in logins:
+        avatar_url = avatar_urls.get(login, "")
+        results[login] = (avatar_url, None) if avatar_url else ("", "not_found")
+    return results
+
+
+def twitch_avatar_entry_fresh(entry: dict, now_ms: int) -> bool:
+    if entry["status"] == "found":
+        ttl_sec = env_int("CHATBOX_TWITCH_AVATAR_TTL_SEC", TWITCH_AVATAR_CACHE_TTL_SEC)
+    else:
+        ttl_sec = env_int("CHATBOX_TWITCH_AVATAR_NEGATIVE_TTL_SEC", TWITCH_AVATAR_NEGATIVE_TTL_SEC)
+    return now_ms - entry["fetched_at_ms"] < ttl_sec * 1000
+
+
+def twitch_avatar_entry_result(entry: dict):
+    if entry["status"] == "found":
+        return entry["avatar_url"], None
+    return "", "not_found"
+
+
+def remember_twitch_avatar(login: str, entry: dict) -> None:
+    with TWITCH_AVATAR_LOCK:
+        TWITCH_AVATAR_CACHE[login] = entry
+        TWITCH_AVATAR_CACHE.move_to_end(login)
+        while len(TWITCH_AVATAR_CACHE) > TWITCH_AVATAR_CACHE_MAX_ENTRIES:
+            TWITCH_AVATAR_CACHE.popitem(last=False)
+
+
+def load_cached_twitch_avatars(logins: list[str]) -> dict:
+    now_ms = int(time.time() * 1000)
+    results = {}
+    misses = []
+    with TWITCH_AVATAR_LOCK:
+        for login in logins:
+            entry = TWITCH_AVATAR_CACHE.get(login)
+            if entry is not None and twitch_avatar_entry_fresh(entry, now_ms):
+                TWITCH_AVATAR_CACHE.move_to_end(login)
+                results[login] = twitch_avatar_entry_result(entry)
+            else:
+                TWITCH_AVATAR_CACHE.pop(login, None)
+                misses.append(login)
+    record_cache_lookups("twitch_avatar", len(logins) - len(misses), len(misses))
+    if not misses:
+        return results
+
+    with db_connection() as connection:
+        rows = connection.execute(
+            f"""
+            SELECT login, avatar_url, status, fetched_at_ms
+            FROM twitch_avatars
+            WHERE login IN ({", ".join("?" for _ in misses)})
+            """,
+            misses,
+        ).fetchall()
+
+    used = []
+    for row in rows:
+        entry = {"avatar_url": row["avatar_url"], "status": row["status"], "fetched_at_ms": row["fetched_at_ms"]}
+        if twitch_avatar_entry_fresh(entry, now_ms):
+            remember_twitch_avatar(row["login"], entry)
+            results[row["login"]] = twitch_avatar_entry_result(entry)
+            used.append((now_ms, row["login"]))
+    record_cache_lookups("twitch_avatar_store", len(used), len(misses) - len(used))
+    if used:
+        with DB_LOCK, db_connection() as connection:
+            connection.executemany("UPDATE twitch_avatars SET last_used_ms = ? WHERE login = ?", used)
+            connection.commit()
+    return results
 
-    users = payload.get("data", [])
-    if not users:
-        return "", "not_found"
 
-    avatar_url = str(users[0].get("profile_image_url") or "").strip()
-    if avatar_url:
-        TWITCH_AVATAR_CACHE[login] = {
-            "avatar_url": avatar_url,
-            "timestamp": now,
-        }
-    return avatar_url, None
+def store_twitch_avatars(entries: list[tuple[str, str, str]]) -> None:
+    if not entries:
+        return
+    now_ms = int(time.time() * 1000)
+    for login, avatar_url, status in entries:
+        remember_twitch_avatar(login, {"avatar_url": avatar_url, "status": status, "fetched_at_ms": now_ms})
+    max_rows = max(1, env_int("CHATBOX_TWITCH_AVATAR_CACHE_MAX_ROWS", TWITCH_AVATAR_STORE_MAX_ROWS))
+    with DB_LOCK, db_connection() as connection:
+        connection.executemany(
+            """
+            INSERT INTO twitch_avatars (login, avatar_url, status, fetched_at_ms, last_used_ms)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(login) DO UPDATE SET
+                avatar_url = excluded.avatar_url,
+                status = excluded.status,
+                fetched_at_ms = excluded.fetched_at_ms,
+                last_used_ms = excluded.last_used_ms
+            """,
+            [(login, avatar_url, status, now_ms, now_ms) for login, avatar_url, status in entries],
+        )
+        connection.execute(
+            """
+            DELETE FROM twitch_avatars
+            WHERE login IN (
+                SELECT login
+                FROM twitch_avatars
+                ORDER BY last_used_ms ASC
+                LIMIT max(0, (SELECT COUNT(*) FROM twitch_avatars) - ?)
+            )
+            """,
+            (max_rows,),
+        )
+        connection.commit()
 
 
 def persist_twitch_avatar(login: str, avatar_url: str, user_id: str = "", message_id: str = "") -> None:
     if not login or not avatar_url:
         return
 
-    with DB_LOCK:
-        connection = sqlite3.connect(DB_PATH)
+    with DB_LOCK, db_connection() as connection:
+        changes_before = connection.total_changes
         if user_id:
-            connection.execute(
-                """
-                UPDATE messages
-                SET avatar_url = ?
-                WHERE platform = 'twitch'
-                  AND user_id = ?
-                """,
-                (avatar_url, user_id),
-            )
+            upsert_user(connection, "twitch", user_id, login, avatar_url)
         elif message_id:
             connection.execute(
                 """
-                UPDATE messages
-                SET avatar_url = ?
-                WHERE platform = 'twitch'
-                  AND message_id = ?
+                UPDATE users
+                SET avatar_url = ?, updated_at_ms = ?
+                WHERE id = (
+                    SELECT user_ref
+                    FROM messages
+                    WHERE platform = 'twitch'
+                      AND message_id = ?
+                )
+                  AND avatar_url <> ?
                 """,
-                (avatar_url, message_id),
+                (avatar_url, int(time.time() * 1000), message_id, avatar_url),
             )
         else:
+            update_twitch_user_avatars(connection, {login: avatar_url})
+        changed = connection.total_changes != changes_before
+        connection.commit()
+    if changed:
+        bump_store_version("history")
+
+
+def persist_twitch_avatars(avatars: dict) -> None:
+    if not avatars:
+        return
+
+    with DB_LOCK, db_connection() as connection:
+        changed = update_twitch_user_avatars(connection, avatars)
+        connection.commit()
+    if changed:
+        bump_store_version("history")
+
+
+def update_twitch_user_avatars(connection: sqlite3.Connection, avatars: dict) -> int:
+    cursor = connection.executemany(
+        """
+        UPDATE users
+        SET avatar_url = ?, updated_at_ms = ?
+        WHERE platform = 'twitch'
+          AND login = ?
+          AND avatar_url <> ?
+        """,
+        [(avatar_url, int(time.time() * 1000), login, avatar_url) for login, avatar_url in avatars.items()],
+    )
+    return cursor.rowcount
+
+
+def run_history_retention(now_ms: int | None = None) -> int:
+    max_age_days = env_int("CHATBOX_HISTORY_MAX_AGE_DAYS", 14)
+    max_rows_per_platform = env_int("CHATBOX_HISTORY_MAX_ROWS_PER_PLATFORM", HISTORY_MAX_ROWS_PER_PLATFORM)
+    if max_age_days <= 0 and max_rows_per_platform <= 0:
+        return 0
+
+    if now_ms is None:
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+    cutoff_ms = now_ms - max_age_days * 86_400_000 if max_age_days > 0 else 0
+
+    archived_total = 0
+    connection = open_db_connection()
+    try:
+        connection.execute("ATTACH DATABASE ? AS archive", (str(ARCHIVE_DB_PATH),))
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS retention_candidates (id INTEGER PRIMARY KEY)")
+        while True:
+            with DB_LOCK:
+                archived = archive_history_batch(connection, cutoff_ms, max_rows_per_platform)
+            archived_total += archived
+            if archived < HISTORY_RETENTION_BATCH_SIZE:
+                break
+
+        with DB_LOCK:
+            if cutoff_ms:
+                connection.execute("DELETE FROM removed_messages WHERE removed_at_ms < ?", (cutoff_ms,))
+            if archived_total:
+                connection.execute(
+                    "DELETE FROM users WHERE NOT EXISTS (SELECT 1 FROM messages WHERE messages.user_ref = users.id)"
+                )
+            connection.commit()
+            connection.execute(f"PRAGMA main.incremental_vacuum({HISTORY_VACUUM_PAGES})").fetchall()
+    finally:
+        connection.close()
+
+    if archived_total:
+        bump_store_version("history")
+    return archived_total
+
+
+def archive_history_batch(connection: sqlite3.Connection, cutoff_ms: int, max_rows_per_platform: int) -> int:
+    connection.execute("DELETE FROM temp.retention_candidates")
+    if cutoff_ms:
+        connection.execute(
+            """
+            INSERT OR IGNORE INTO temp.retention_candidates (id)
+            SELECT id
+            FROM messages
+            WHERE timestamp_ms < ?
+            ORDER BY timestamp_ms ASC
+            LIMIT ?
+            """,
+            (cutoff_ms, HISTORY_RETENTION_BATCH_SIZE),
+        )
+    if max_rows_per_platform > 0:
+        platforms = [row[0] for row in connection.execute("SELECT DISTINCT platform FROM messages").fetchall()]
+        for platform in platforms:
             connection.execute(
                 """
-                UPDATE messages
-                SET avatar_url = ?
-                WHERE platform = 'twitch'
-                  AND lower(username) = ?
+                INSERT OR IGNORE INTO temp.retention_candidates (id)
+                SELECT id
+                FROM messages
+                WHERE platform = ?
+                ORDER BY timestamp_ms DESC, id DESC
+                LIMIT ? OFFSET ?
                 """,
-                (avatar_url, login),
+                (platform, HISTORY_RETENTION_BATCH_SIZE, max_rows_per_platform),
             )
-        connection.commit()
-        connection.close()
+
+    columns = [(row[1], row[2]) for row in connection.execute("PRAGMA main.table_info(messages)").fetchall()]
+    column_list = ", ".join(name for name, _ in columns)
+    day_expression = "COALESCE(strftime('%Y%m%d', timestamp_ms / 1000, 'unixepoch'), '00000000')"
+    days = [
+        row[0]
+        for row in connection.execute(
+            f"""
+            SELECT DISTINCT {day_expression}
+            FROM main.messages
+            WHERE id IN (SELECT id FROM temp.retention_candidates)
+            """
+        ).fetchall()
+    ]
+    if days:
+        for table, column in INTERN_TABLES.items():
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS archive.{table} (id INTEGER PRIMARY KEY, {column} TEXT NOT NULL UNIQUE)"
+            )
+            connection.execute(
+                f"INSERT OR IGNORE INTO archive.{table} (id, {column}) SELECT id, {column} FROM main.{table}"
+            )
+    for day in days:
+        table_name = f"messages_{day}"
+        ensure_archive_table(connection, table_name, columns)
+        connection.execute(
+            f"""
+            INSERT OR IGNORE INTO archive.{table_name} ({column_list})
+            SELECT {column_list}
+            FROM main.messages
+            WHERE id IN (SELECT id FROM temp.retention_candidates)
+              AND {day_expression} = ?
+            """,
+            (day,),
+        )
+    # A transaction spanning an attached WAL database is not atomic across both files, so make the
+    # archive copy durable first; if the delete below is lost, the next pass re-archives idempotently.
+    connection.commit()
+
+    archived = connection.execute(
+        "DELETE FROM main.messages WHERE id IN (SELECT id FROM temp.retention_candidates)"
+    ).rowcount
+    connection.commit()
+    return archived
+
+
+def ensure_archive_table(connection: sqlite3.Connection, table_name: str, columns: list[tuple[str, str]]) -> None:
+    definitions = ", ".join(
+        "id INTEGER PRIMARY KEY" if name == "id" else f"{name} {column_type}"
+        for name, column_type in columns
+    )
+    connection.execute(f"CREATE TABLE IF NOT EXISTS archive.{table_name} ({definitions})")
+    existing_columns = {
+        row[1]
+        for row in connection.execute(f"PRAGMA archive.table_info({table_name})").fetchall()
+    }
+    for name, column_type in columns:
+        if name not in existing_columns:
+            connection.execute(f"ALTER TABLE archive.{table_name} ADD COLUMN {name} {column_type}")
+
+
+def run_retention_worker() -> None:
+    interval_sec = max(30, env_int("CHATBOX_HISTORY_RETENTION_INTERVAL_SEC", 900))
+    while True:
+        try:
+            archived = run_history_retention()
+            if archived:
+                write_log("info", f"History retention archived {archived} messages to {ARCHIVE_DB_PATH}")
+        except sqlite3.Error as error:
+            write_log("error", f"History retention failed: {error}")
+        if RETENTION_STOP.wait(interval_sec):
+            return
+
+
+def run_buffered_request(raw_request: bytes, client_address, response_file: AsyncResponseFile) -> None:
+    BufferedOverlayHandler(raw_request, client_address, response_file)
+
+
+def parse_request_head(head: bytes) -> tuple[str, str, dict]:
+    lines = head.decode("iso-8859-1").split("\r\n")
+    parts = lines[0].split()
+    method = parts[0] if parts else ""
+    target = parts[1] if len(parts) > 1 else "/"
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(":")
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+def notify_async_stream_waiters() -> None:
+    global ASYNC_STREAM_WAKEUP
+    wakeup = ASYNC_STREAM_WAKEUP
+    ASYNC_STREAM_WAKEUP = asyncio.Event()
+    wakeup.set()
+
+
+async def handle_async_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, executor: ThreadPoolExecutor) -> None:
+    client_address = writer.get_extra_info("peername") or ("", 0)
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), ASYNC_REQUEST_TIMEOUT_SEC)
+        method, target, headers = parse_request_head(head)
+        try:
+            content_length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            content_length = 0
+        body = await reader.readexactly(content_length) if content_length > 0 else b""
+
+        parsed = urlparse(target)
+        if method == "GET" and parsed.path == "/api/history/stream":
+            await serve_async_history_stream(writer, parsed, headers, client_address)
+            return
+
+        loop = asyncio.get_running_loop()
+        response_file = AsyncResponseFile(writer, loop)
+        await loop.run_in_executor(executor, run_buffered_request, head + body, client_address[:2], response_file)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async_history_stream(writer: asyncio.StreamWriter, parsed, headers: dict, client_address) -> None:
+    params = parse_qs(parsed.query or "")
+    last_event_id = headers.get("last-event-id", "") or first_query_value(params, "lastEventId")
+    topics = parse_stream_topics(params)
+    token = object()
+    cursor, resync = open_stream_cursor(token, last_event_id, topics)
+    record_request("GET", parsed.path, HTTPStatus.OK, 0.0, 0, client_address[0])
+    try:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-store\r\n"
+            b"Connection: keep-alive\r\n"
+            b"\r\n"
+        )
+        chunk = b"retry: 3000\n: connected\n\n"
+        if resync:
+            chunk += format_stream_event(cursor, STREAM_RESYNC_MESSAGE)
+        chunk += format_state_snapshot(cursor, topics)
+
+        while True:
+            if chunk:
+                writer.write(chunk)
+                await writer.drain()
+                increment_metric("chatbox_http_response_bytes_total", METRICS_STREAM_LABELS, len(chunk))
+            wakeup = ASYNC_STREAM_WAKEUP
+            events, cursor, lagged = collect_stream_events(token, cursor, topics)
+            if lagged:
+                chunk = format_stream_event(cursor, STREAM_RESYNC_MESSAGE)
+            elif events:
+                chunk = b"".join(format_stream_event(sequence, message) for sequence, message in events)
+            else:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), STREAM_KEEPALIVE_SEC)
+                    chunk = b""
+                except asyncio.TimeoutError:
+                    chunk = b": keepalive\n\n"
+    finally:
+        close_stream_cursor(token)
+
+
+async def serve_async(bind_host: str, port: int) -> None:
+    global ASYNC_STREAM_WAKEUP
+    loop = asyncio.get_running_loop()
+    ASYNC_STREAM_WAKEUP = asyncio.Event()
+
+    def listener() -> None:
+        loop.call_soon_threadsafe(notify_async_stream_waiters)
+
+    STREAM_LISTENERS.append(listener)
+    executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="overlay-request")
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_async_connection(reader, writer, executor),
+        bind_host,
+        port,
+    )
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        STREAM_LISTENERS.remove(listener)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def handle_shutdown_signal(signum, frame) -> None:
+    raise KeyboardInterrupt
 
 
 def main():
+    for name in ("SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle_shutdown_signal)
+    start_log_writer()
+    install_lock_metrics()
+    configure_message_json_cache()
     init_db()
-    bind_host = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
-    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8934
-    server = ThreadingHTTPServer((bind_host, port), OverlayHandler)
-    print(f"Serving overlay on http://{bind_host}:{port} from {ROOT}")
+    init_state_store()
+    init_debug_store()
+    Thread(target=run_retention_worker, name="history-retention", daemon=True).start()
+    for topic in STATE_TOPICS:
+        get_state_topic(topic)
+    Thread(target=run_state_watcher, name="state-watcher", daemon=True).start()
+    start_debug_log_writer()
+    if env_flag("CHATBOX_HISTORY_WRITE_BEHIND"):
+        start_history_writer()
+    flags = {arg for arg in sys.argv[1:] if arg.startswith("--")}
+    positional = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    bind_host = positional[0] if positional else "127.0.0.1"
+    port = int(positional[1]) if len(positional) > 1 else 8934
+    server = None if "--async" in flags else ThreadingHTTPServer((bind_host, port), OverlayHandler)
+    mode = "asyncio" if server is None else "threaded"
+    print(f"Serving overlay ({mode}) on http://{bind_host}:{port} from {ROOT}")
     print(f"History database: {DB_PATH}")
-    server.serve_forever()
+    try:
+        if server is None:
+            asyncio.run(serve_async(bind_host, port))
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        RETENTION_STOP.set()
+        STATE_WATCH_STOP.set()
+        flush_state_exports()
+        close_state_journal()
+        if server is not None:
+            server.server_close()
+        stop_history_writer()
+        stop_debug_log_writer()
+        close_db_pool()
+        stop_log_writer()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,481 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+SERVER_START_TIMEOUT_SEC = 20
+REQUEST_TIMEOUT_SEC = 30
+RSS_SAMPLE_INTERVAL_SEC = 0.5
+POLL_PAGE_LIMIT = 500
+SEED_BATCH_SIZE = 500
+RESULTS_LOCK = Lock()
+LATENCIES = {}
+STATUSES = {}
+ERRORS = {}
+SENT_AT = {}
+DELIVERY_LAGS = []
+STREAM_EVENTS = {"received": 0, "resyncs": 0}
+RSS_SAMPLES = []
+STREAM_CONNECTIONS = []
+PLATFORM_WEIGHTS = (("twitch", 5), ("kick", 3), ("youtube", 2))
+PLATFORM_BADGES = {
+    "twitch": (["Subscriber"], ["Subscriber", "VIP"], ["Moderator", "Subscriber"], []),
+    "kick": (["Subscriber"], ["OG", "Subscriber"], ["Moderator"], []),
+    "youtube": (["Member (6 months)"], ["Moderator"], ["Member (2 years)", "Verified"], []),
+}
+PLATFORM_EMOTES = {
+    "twitch": (
+        ("Kappa", "https://static-cdn.jtvnw.net/emoticons/v2/25/default/dark/1.0"),
+        ("PogChamp", "https://static-cdn.jtvnw.net/emoticons/v2/305954156/default/dark/1.0"),
+        ("LUL", "https://static-cdn.jtvnw.net/emoticons/v2/425618/default/dark/1.0"),
+    ),
+    "kick": (
+        ("KEKW", "https://files.kick.com/emotes/37226/fullsize"),
+        ("emojiAngel", "https://files.kick.com/emotes/39251/fullsize"),
+        ("PeepoClap", "https://files.kick.com/emotes/39261/fullsize"),
+    ),
+    "youtube": (
+        (":yt:", "https://yt3.ggpht.com/m6yqTzfmHlsoKKEZRSZCkqf6cGSeHtStY4rIeeXLAk4N9GY_yw3dizdZoxTrjLhlY4r_rkz3GA=w48-h48-c-k-nd"),
+        (":oops:", "https://yt3.ggpht.com/qByNS7xmuQXsb_5hxW2ggxwQZRN8-biWVnnKuL5FK1zudxIeim48zRVPk6DRq_HgaeKltHhm=w48-h48-c-k-nd"),
+    ),
+}
+CHAT_WORDS = (
+    "bro", "that", "was", "insane", "gg", "lets", "go", "punjabi", "bullet", "hello", "from", "toronto",
+    "what", "song", "is", "this", "w", "stream", "first", "time", "here", "love", "the", "overlay",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test history_server.py with simulated chat, stream and polling clients.")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run the load (default 30)")
+    parser.add_argument("--posters", type=int, default=3, help="concurrent chat posters (default 3)")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second per poster (default 5)")
+    parser.add_argument("--subscribers", type=int, default=4, help="live stream (SSE) subscribers (default 4)")
+    parser.add_argument("--pollers", type=int, default=4, help="/api/history pollers (default 4)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between polls per poller (default 1)")
+    parser.add_argument("--seed-rows", type=int, default=0, help="history rows to insert before the run (default 0)")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="start the server with --async")
+    parser.add_argument("--write-behind", action="store_true", help="enable CHATBOX_HISTORY_WRITE_BEHIND on the server")
+    parser.add_argument("--random-seed", type=int, default=1, help="seed for generated payloads (default 1)")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the temp directory with the database and server log")
+    return parser.parse_args()
+
+
+def find_free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def start_server(directory: Path, host: str, port: int, args) -> subprocess.Popen:
+    scripts_dir = directory / "scripts"
+    scripts_dir.mkdir(parents=True)
+    (directory / "data").mkdir()
+    shutil.copy2(SCRIPT_DIR / "history_server.py", scripts_dir / "history_server.py")
+
+    env = dict(os.environ)
+    env.pop("CHATBOX_TWITCH_CLIENT_ID", None)
+    env.pop("CHATBOX_TWITCH_ACCESS_TOKEN", None)
+    if args.write_behind:
+        env["CHATBOX_HISTORY_WRITE_BEHIND"] = "1"
+    command = [sys.executable, str(scripts_dir / "history_server.py"), host, str(port)]
+    if args.async_mode:
+        command.append("--async")
+    log_handle = (directory / "server.log").open("wb")
+    try:
+        return subprocess.Popen(command, cwd=directory, env=env, stdout=log_handle, stderr=subprocess.STDOUT)
+    finally:
+        log_handle.close()
+
+
+def wait_for_server(host: str, port: int, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            status, _, _ = send_request(host, port, "GET", "/api/settings")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("server did not start in time")
+
+
+def send_request(host: str, port: int, method: str, path: str, payload=None, headers=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request_headers = dict(headers or {})
+    if body is not None:
+        request_headers["Content-Type"] = "application/json"
+    connection = http.client.HTTPConnection(host, port, timeout=REQUEST_TIMEOUT_SEC)
+    try:
+        connection.request(method, path, body=body, headers=request_headers)
+        response = connection.getresponse()
+        return response.status, response.getheader("ETag", ""), response.read()
+    finally:
+        connection.close()
+
+
+def timed_request(kind: str, host: str, port: int, method: str, path: str, payload=None, headers=None):
+    started = time.perf_counter()
+    try:
+        status, etag, body = send_request(host, port, method, path, payload, headers)
+    except OSError as error:
+        record_error(kind, type(error).__name__)
+        return None, "", b""
+    elapsed = time.perf_counter() - started
+    with RESULTS_LOCK:
+        LATENCIES.setdefault(kind, []).append(elapsed)
+        statuses = STATUSES.setdefault(kind, {})
+        statuses[status] = statuses.get(status, 0) + 1
+    return status, etag, body
+
+
+def record_error(kind: str, reason: str) -> None:
+    with RESULTS_LOCK:
+        errors = ERRORS.setdefault(kind, {})
+        errors[reason] = errors.get(reason, 0) + 1
+
+
+def build_message(rng: random.Random, poster: int, index: int, timestamp_ms: int) -> dict:
+    platform = rng.choices([name for name, _ in PLATFORM_WEIGHTS], [weight for _, weight in PLATFORM_WEIGHTS])[0]
+    chatter = rng.randrange(2000)
+    words = " ".join(rng.choice(CHAT_WORDS) for _ in range(rng.randint(2, 14)))
+    emote_name, emote_url = rng.choice(PLATFORM_EMOTES[platform])
+    content_parts = [{"type": "text", "text": f"{words} "}]
+    if rng.random() < 0.4:
+        content_parts.append({"type": "emote", "text": emote_name, "imageUrl": emote_url})
+    content_parts.append({"type": "text", "text": f" #{poster}-{index}"})
+
+    message = {
+        "platform": platform,
+        "variant": "chat",
+        "username": f"{platform.title()}Chatter{chatter}",
+        "userId": f"{platform}-{chatter}",
+        "text": "".join(part["text"] for part in content_parts),
+        "color": f"#{rng.randrange(0x1000000):06x}",
+        "avatarUrl": f"https://example.invalid/{platform}/avatars/{chatter}.png" if platform != "twitch" else "",
+        "isBroadcaster": False,
+        "timestamp": timestamp_ms,
+        "badges": list(rng.choice(PLATFORM_BADGES[platform])),
+        "amountText": "",
+        "tone": "",
+        "memberLabel": "",
+        "messageId": f"load-{poster}-{index}",
+        "contentParts": content_parts,
+    }
+
+    roll = rng.random()
+    if roll < 0.04:
+        message["variant"] = "member"
+        message["memberLabel"] = {"twitch": "Subscribed for 3 months", "kick": "New subscriber", "youtube": "Member for 6 months"}[platform]
+    elif roll < 0.10:
+        message["variant"] = "special"
+        if platform == "youtube":
+            message["amountText"] = rng.choice(("$2.00", "$5.00", "CA$20.00", "₹199.00"))
+            message["tone"] = rng.choice(("tone-youtube-blue", "tone-youtube-green", "tone-youtube-red"))
+        elif platform == "kick":
+            gift = rng.choice((("hell-yeah", "Hell Yeah"), ("rage-quit", "Rage Quit"), ("full-send", "Full Send")))
+            message["amountText"] = f"{rng.choice((1, 10, 100))} KICKs"
+            message["tone"] = "tone-kick-gift"
+            message["giftId"] = gift[0]
+            message["giftName"] = gift[1]
+            message["giftImageUrl"] = f"https://files.kick.com/kicks/gifts/{gift[0]}.webp"
+        else:
+            message["amountText"] = f"{rng.choice((100, 500, 1000))} bits"
+            message["tone"] = "tone-bits-twitch"
+    return message
+
+
+def seed_history(host: str, port: int, rows: int, rng: random.Random) -> None:
+    now_ms = int(time.time() * 1000)
+    for offset in range(0, rows, SEED_BATCH_SIZE):
+        batch = [
+            build_message(rng, -1, index, now_ms - (rows - index) * 250)
+            for index in range(offset, min(rows, offset + SEED_BATCH_SIZE))
+        ]
+        status, _, body = send_request(host, port, "POST", "/api/history/batch", {"messages": batch})
+        if status != 200:
+            raise RuntimeError(f"seeding failed with {status}: {body[:200]!r}")
+
+
+def run_poster(host: str, port: int, poster: int, args, stop: Event) -> None:
+    rng = random.Random(args.random_seed * 1000 + poster)
+    interval = 1.0 / args.rate if args.rate > 0 else 1.0
+    next_at = time.perf_counter() + rng.random() * interval
+    index = 0
+    while not stop.is_set():
+        delay = next_at - time.perf_counter()
+        if delay > 0 and stop.wait(delay):
+            return
+        next_at += rng.expovariate(1.0 / interval)
+        message = build_message(rng, poster, index, int(time.time() * 1000))
+        index += 1
+        with RESULTS_LOCK:
+            SENT_AT[message["messageId"]] = time.perf_counter()
+        timed_request("post /api/history", host, port, "POST", "/api/history", message)
+
+
+def run_poller(host: str, port: int, poller: int, args, stop: Event) -> None:
+    rng = random.Random(args.random_seed * 2000 + poller)
+    cursor = 0
+    removed_cursor = None
+    etag = ""
+    etag_path = ""
+    if stop.wait(rng.random() * args.poll_interval):
+        return
+    while not stop.is_set():
+        path = f"/api/history?since={cursor}&limit={POLL_PAGE_LIMIT}"
+        if removed_cursor is not None:
+            path += f"&removedSince={removed_cursor}"
+        headers = {"If-None-Match": etag} if etag and etag_path == path else None
+        status, response_etag, body = timed_request("poll /api/history", host, port, "GET", path, headers=headers)
+        if status == 200:
+            page = json.loads(body)
+            cursor = page.get("cursor", cursor)
+            removed_cursor = page.get("removedCursor", removed_cursor)
+            etag = response_etag
+            etag_path = path
+            if page.get("hasMore"):
+                continue
+        stop.wait(args.poll_interval)
+
+
+def run_subscriber(host: str, port: int, stop: Event) -> None:
+    while not stop.is_set():
+        connection = http.client.HTTPConnection(host, port, timeout=REQUEST_TIMEOUT_SEC + 30)
+        with RESULTS_LOCK:
+            STREAM_CONNECTIONS.append(connection)
+        try:
+            connection.request("GET", "/api/history/stream?topics=history")
+            response = connection.getresponse()
+            if response.status != 200:
+                record_error("stream", f"HTTP {response.status}")
+                stop.wait(1)
+                continue
+            while not stop.is_set():
+                line = response.fp.readline()
+                if not line:
+                    break
+                if line.startswith(b"data: "):
+                    record_stream_event(line[6:])
+        except (OSError, http.client.HTTPException, ValueError) as error:
+            if not stop.is_set():
+                record_error("stream", type(error).__name__)
+        finally:
+            connection.close()
+
+
+def record_stream_event(data: bytes) -> None:
+    received_at = time.perf_counter()
+    event = json.loads(data)
+    if event.get("type") == "message":
+        messages = [event.get("message") or {}]
+    elif event.get("type") == "batch":
+        messages = event.get("messages") or []
+    else:
+        with RESULTS_LOCK:
+            STREAM_EVENTS["resyncs" if event.get("type") == "resync" else "received"] += 1
+        return
+    with RESULTS_LOCK:
+        for message in messages:
+            STREAM_EVENTS["received"] += 1
+            sent_at = SENT_AT.get(message.get("messageId"))
+            if sent_at is not None:
+                DELIVERY_LAGS.append(received_at - sent_at)
+
+
+def read_rss_bytes(pid: int) -> int | None:
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def run_rss_sampler(pid: int, stop: Event) -> None:
+    while True:
+        rss = read_rss_bytes(pid)
+        if rss is not None:
+            RSS_SAMPLES.append(rss)
+        if stop.wait(RSS_SAMPLE_INTERVAL_SEC):
+            return
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50Ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95Ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99Ms": round(percentile(values, 0.99) * 1000, 2),
+        "maxMs": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def build_report(args, elapsed_sec: float) -> dict:
+    with RESULTS_LOCK:
+        requests = {}
+        for kind, values in sorted(LATENCIES.items()):
+            requests[kind] = {
+                **summarize(values),
+                "perSec": round(len(values) / elapsed_sec, 1),
+                "statuses": {str(status): count for status, count in sorted(STATUSES.get(kind, {}).items())},
+                "errors": dict(ERRORS.get(kind, {})),
+            }
+        posted = len(SENT_AT)
+        expected = posted * args.subscribers
+        delivery = {
+            **summarize(DELIVERY_LAGS),
+            "expected": expected,
+            "missing": max(0, expected - len(DELIVERY_LAGS)),
+            "resyncs": STREAM_EVENTS["resyncs"],
+            "errors": dict(ERRORS.get("stream", {})),
+        }
+    return {
+        "mode": "async" if args.async_mode else "threaded",
+        "writeBehind": args.write_behind,
+        "durationSec": round(elapsed_sec, 2),
+        "posters": args.posters,
+        "ratePerPoster": args.rate,
+        "subscribers": args.subscribers,
+        "pollers": args.pollers,
+        "pollIntervalSec": args.poll_interval,
+        "seedRows": args.seed_rows,
+        "requests": requests,
+        "streamDelivery": delivery,
+        "serverRssMiB": {
+            "start": round(RSS_SAMPLES[0] / 1048576, 1) if RSS_SAMPLES else None,
+            "peak": round(max(RSS_SAMPLES) / 1048576, 1) if RSS_SAMPLES else None,
+            "end": round(RSS_SAMPLES[-1] / 1048576, 1) if RSS_SAMPLES else None,
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['mode']} server, {report['durationSec']}s, {report['posters']} posters x {report['ratePerPoster']}/s, "
+        f"{report['subscribers']} subscribers, {report['pollers']} pollers every {report['pollIntervalSec']}s"
+    )
+    print(f"  {'requests':<20} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for kind, stats in report["requests"].items():
+        statuses = ", ".join(f"{status}: {count}" for status, count in stats["statuses"].items())
+        errors = ", ".join(f"{reason}: {count}" for reason, count in stats["errors"].items())
+        print(
+            f"  {kind:<20} {stats['count']:>7} {stats['perSec']:>8} {stats['p50Ms']:>8} {stats['p95Ms']:>8} "
+            f"{stats['p99Ms']:>8} {stats['maxMs']:>8}  {statuses}{'  errors ' + errors if errors else ''}"
+        )
+    delivery = report["streamDelivery"]
+    print(
+        f"  {'stream delivery lag':<20} {delivery['count']:>7} {'':>8} {delivery['p50Ms']:>8} {delivery['p95Ms']:>8} "
+        f"{delivery['p99Ms']:>8} {delivery['maxMs']:>8}  missing: {delivery['missing']}, resyncs: {delivery['resyncs']}"
+    )
+    rss = report["serverRssMiB"]
+    if rss["peak"] is None:
+        print("  server RSS: not available (install psutil)")
+    else:
+        print(f"  server RSS: {rss['start']} MiB at start, {rss['peak']} MiB peak, {rss['end']} MiB at end")
+
+
+def main():
+    args = parse_args()
+    host = "127.0.0.1"
+    directory = Path(tempfile.mkdtemp(prefix="chatbox-load-"))
+    port = find_free_port(host)
+    process = start_server(directory, host, port, args)
+    stop = Event()
+    sampler_stop = Event()
+    try:
+        wait_for_server(host, port, process)
+        if args.seed_rows:
+            print(f"Seeding {args.seed_rows:,} history rows")
+            seed_history(host, port, args.seed_rows, random.Random(args.random_seed))
+
+        sampler = Thread(target=run_rss_sampler, args=(process.pid, sampler_stop), daemon=True)
+        sampler.start()
+        threads = [Thread(target=run_subscriber, args=(host, port, stop), daemon=True) for _ in range(args.subscribers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        threads += [
+            Thread(target=run_poller, args=(host, port, index, args, stop), daemon=True) for index in range(args.pollers)
+        ]
+        threads += [
+            Thread(target=run_poster, args=(host, port, index, args, stop), daemon=True) for index in range(args.posters)
+        ]
+        for thread in threads[args.subscribers:]:
+            thread.start()
+
+        print(f"Running for {args.duration:.0f}s against http://{host}:{port} (pid {process.pid})")
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        time.sleep(0.5)
+        with RESULTS_LOCK:
+            connections = list(STREAM_CONNECTIONS)
+        for connection in connections:
+            if connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for thread in threads:
+            thread.join(REQUEST_TIMEOUT_SEC)
+        sampler_stop.set()
+        sampler.join()
+
+        report = build_report(args, elapsed)
+        print_report(report)
+        if args.json_path:
+            Path(args.json_path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+            print(f"Wrote {args.json_path}")
+    finally:
+        stop.set()
+        sampler_stop.set()
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if args.keep:
+            print(f"Kept {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ param(
   [int]$Port = 8080,
   [string]$OverlayBindAddress = "127.0.0.1",
   [int]$OverlayPort = 8934,
-  [string]$Password = ""
+  [string]$Password = "",
+  [switch]$AsyncServer
 )
 
 $scriptDir = Split-Path -Parent $MyInvocation.MyCommand.Path
@@ -25,7 +26,12 @@ foreach ($proc in $existing) {
   Stop-Process -Id $proc.ProcessId -Force -ErrorAction SilentlyContinue
 }
 
-Start-Process -FilePath $pythonExe -ArgumentList @($serverScript, $OverlayBindAddress, $OverlayPort) -WorkingDirectory $projectRoot -WindowStyle Hidden | Out-Null
+$serverArgs = @($serverScript, $OverlayBindAddress, $OverlayPort)
+if ($AsyncServer) {
+  $serverArgs += "--async"
+}
+
+Start-Process -FilePath $pythonExe -ArgumentList $serverArgs -WorkingDirectory $projectRoot -WindowStyle Hidden | Out-Null
 
 Start-Sleep -Seconds 2
 